@@ -1,63 +1,190 @@
-from flask import Flask, render_template, request, send_file, redirect, url_for, jsonify
+from flask import Flask, render_template, request, send_file, redirect, url_for, jsonify, Response, abort, g
 from travel_scraper import TravelDataScraper
-from xhtml2pdf import pisa
+from cache import DiskCache, LRUCache, SingleFlight
+from jobs import JobManager
+from llm_client import ChatClient
+from chat_context import compact_itinerary
+from places import trip_json, places_event, trip_geojson
+from pdf_renderer import PDFRenderer, PDFBusyError
+import metrics
 import io
 import os
-import requests
-from langchain.llms import HuggingFaceHub
+import hashlib
+import gzip
+import json
 import os
+import time
+from urllib.parse import urlencode
 from dotenv import load_dotenv
 
 load_dotenv()
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_API_URL = os.getenv("GROQ_API_URL")
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-8b-8192")
+CHAT_ERROR_REPLY = "Sorry, I couldn't process your request at the moment."
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", 800))
+# Opt-in: adds a Server-Timing header with the per-stage breakdown of each
+# response, which exposes internal stage and upstream timings to clients
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") not in ("0", "false", "no")
 app = Flask(__name__)
 scraper = TravelDataScraper()
+# Generated itineraries by trip id, so the PDF and map views reuse the trip
+# the user is looking at instead of scraping (and randomising) it again
+trips = LRUCache(maxsize=int(os.getenv("TRIP_CACHE_SIZE", 256)), ttl=int(os.getenv("TRIP_CACHE_TTL", 6 * 3600)))
+# Identical trips requested at the same time are planned once
+trip_flight = SingleFlight()
+# Map documents by trip id, serialized and gzipped once; build_trip drops a
+# trip's entry when it plans the trip again
+geojson_cache = LRUCache(maxsize=int(os.getenv("TRIP_CACHE_SIZE", 256)), ttl=int(os.getenv("TRIP_CACHE_TTL", 6 * 3600)))
+# Background workers for /api/trips, so planning doesn't hold request threads.
+# Job state is mirrored to disk, so status polls can land on any worker.
+jobs = JobManager(max_workers=int(os.getenv("TRIP_WORKERS", 4)), store=DiskCache('jobs', ttl=3600))
+# PDFs render in separate processes and are cached by content hash
+pdf_renderer = PDFRenderer(max_workers=int(os.getenv("PDF_WORKERS", 2)), max_pending=int(os.getenv("PDF_MAX_PENDING", 8)))
+chat_client = ChatClient(GROQ_API_URL, GROQ_API_KEY, GROQ_MODEL, timeout=float(os.getenv("GROQ_TIMEOUT", 30)))
 
-# Initialize LangChain LLM with Hugging Face Hub (Mistral-7B-Instruct)
-hf_api_key = "Add the key"
-llm = HuggingFaceHub(
-    repo_id="mistralai/Mistral-7B-Instruct-v0.2",
-    huggingfacehub_api_token=hf_api_key
-)
+# LangChain LLM with Hugging Face Hub (Mistral-7B-Instruct). Importing
+# langchain is slow and no route needs it yet, so it is built on first use.
+hf_api_key = os.getenv("HF_API_KEY", "Add the key")
+_llm = None
+
+def get_llm():
+    global _llm
+    if _llm is None:
+        from langchain.llms import HuggingFaceHub
+        _llm = HuggingFaceHub(
+            repo_id="mistralai/Mistral-7B-Instruct-v0.2",
+            huggingfacehub_api_token=hf_api_key
+        )
+    return _llm
 
   # Corrected endpoint  # Example endpoint
 
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    g.timing_token = metrics.start_breakdown()
+
+@app.after_request
+def record_timing(response):
+    elapsed = time.perf_counter() - g.request_start
+    metrics.http_request_seconds.observe(elapsed, endpoint=request.endpoint or 'unmatched')
+    timings = metrics.end_breakdown(g.pop('timing_token'))
+    if SERVER_TIMING:
+        timings['total'] = elapsed
+        response.headers['Server-Timing'] = metrics.server_timing_header(timings)
+    return response
+
+@app.teardown_request
+def reset_timing(exc):
+    # after_request is skipped when a view raises
+    token = g.pop('timing_token', None)
+    if token is not None:
+        metrics.end_breakdown(token)
+
+@app.route('/metrics')
+def metrics_view():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/chat', methods=['POST'])
 def chat():
     user_message = request.json['message']
+    # Prefer the server-side copy of the trip; the client only posts the
+    # full itinerary when we no longer have it
+    trip_id = request.json.get('trip_id')
     itinerary = request.json.get('itinerary')
-    if itinerary:
-        itinerary_summary = f"Here is the user's itinerary: {itinerary}. "
+    places = request.json.get('places')
+    if trip_id and not itinerary:
+        data = lookup_trip(trip_id)
+        if data is None:
+            return jsonify({'error': 'unknown trip'}), 409
+        context = compact_itinerary(data['itinerary'], data['travel_info'], data['starting_city'], data['destination'], max_tokens=CHAT_CONTEXT_TOKENS, places=data['places'].to_list())
+    elif itinerary:
+        context = compact_itinerary(itinerary, max_tokens=CHAT_CONTEXT_TOKENS, places=places)
+    else:
+        context = None
+    if context:
+        itinerary_summary = f"Here is the user's itinerary:\n{context}\n"
     else:
         itinerary_summary = ""
     prompt = f"You are a helpful travel assistant. {itinerary_summary}User question: {user_message}"
-
-    # Groq API payload
-    payload = {
-        "model": "llama3-8b-8192",  # Replace with your Groq model name
-        "messages": [
-            {"role": "system", "content": "You are a helpful travel assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        "max_tokens": 512,
-        "temperature": 0.7
-    }
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    response = requests.post(GROQ_API_URL, json=payload, headers=headers)
-    print("Status code:", response.status_code)
-    print("Response text:", response.text)
-    if response.status_code == 200:
-        data = response.json()
-        reply = data['choices'][0]['message']['content']
-    else:
-        reply = "Sorry, I couldn't process your request at the moment."
+    messages = [
+        {"role": "system", "content": "You are a helpful travel assistant."},
+        {"role": "user", "content": prompt}
+    ]
+    params = {"max_tokens": 512, "temperature": 0.7}
+    if request.json.get('stream'):
+        # Relay tokens to the chat widget as the model produces them
+        def generate():
+            sent = False
+            try:
+                for delta in chat_client.stream(messages, **params):
+                    sent = True
+                    yield delta
+            except Exception:
+                app.logger.exception("Chat completion failed")
+                # Don't tack the apology onto a partial answer
+                if not sent:
+                    yield CHAT_ERROR_REPLY
+        return Response(generate(), mimetype='text/plain', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    try:
+        reply = chat_client.complete(messages, **params)
+    except Exception:
+        app.logger.exception("Chat completion failed")
+        reply = CHAT_ERROR_REPLY
     return jsonify({'response': reply})
 
+def make_trip_id(starting_city, destination, days, budget=None, seed=0):
+    key = f"{starting_city.strip().lower()}|{destination.strip().lower()}|{days}|{budget}|{seed}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def lookup_trip(trip_id):
+    data = trips.get(trip_id)
+    metrics.cache_lookup('trip', data is not None)
+    return data
+
+def get_trip(starting_city, destination, days, budget=None, seed=0, progress=None):
+    # Returns the cached trip, generating and caching it on a miss
+    trip_id = make_trip_id(starting_city, destination, days, budget, seed)
+    data = lookup_trip(trip_id)
+    if data is None:
+        data = trip_flight.do(trip_id, lambda: build_trip(trip_id, starting_city, destination, days, budget, seed, progress))
+    return data
+
+def build_trip(trip_id, starting_city, destination, days, budget, seed, progress):
+    # Another request may have finished this trip while we waited to lead
+    data = trips.get(trip_id)
+    if data is None:
+        data = scraper.scrape_all_data(starting_city, destination, days, budget, seed=seed, progress=progress)
+        data['trip_id'] = trip_id
+        trips.set(trip_id, data)
+        geojson_cache.pop(trip_id)
+    return data
+
+def trip_from_request(values):
+    # Look the trip up by id; older links and evicted trips fall back to the
+    # trip parameters, which regenerates the same (seeded) itinerary
+    trip_id = values.get('trip_id')
+    data = lookup_trip(trip_id) if trip_id else None
+    if data is None:
+        try:
+            starting_city, destination, days = values['starting_city'], values['destination'], int(values['days'])
+        except (KeyError, ValueError):
+            abort(400)
+        data = get_trip(starting_city, destination, days, optional_int(values.get('budget')), optional_int(values.get('seed'), 0))
+    return data
+
+def optional_int(value, default=None):
+    # Form values may be missing, empty or a rendered "None"
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+def render_trip(data):
+    return render_template('index.html', itinerary=data['itinerary'], places=data['places'], trip_json=trip_json(data['itinerary'], data['places']), travel_info=data['travel_info'], starting_city=data['starting_city'], destination=data['destination'], days=data['days'], budget=data['budget'], seed=data['seed'], trip_id=data['trip_id'])
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
@@ -65,41 +192,136 @@ def index():
         destination = request.form['destination']
         days = int(request.form['days'])
         budget = int(request.form['budget'])
-        data = scraper.scrape_all_data(starting_city, destination, days, budget)
-        itinerary = data['itinerary']
-        travel_info = data['travel_info']
-        return render_template('index.html', itinerary=itinerary, travel_info=travel_info, starting_city=starting_city, destination=destination, days=days, budget=budget)
+        seed = int(request.form.get('seed', 0))
+        return render_trip(get_trip(starting_city, destination, days, budget, seed))
     return render_template('index.html', itinerary=None)
 
-def generate_itinerary(starting_city, destination, days):
-    data = scraper.scrape_all_data(starting_city, destination, days)
-    return data['itinerary']
+def trip_params(starting_city, destination, days, budget=None, seed=0):
+    # Query parameters that let any worker rebuild the trip (see trip_from_request)
+    params = {'starting_city': starting_city, 'destination': destination, 'days': days, 'budget': budget, 'seed': seed}
+    return {key: value for key, value in params.items() if value is not None}
+
+@app.route('/trip/<trip_id>')
+def trip_view(trip_id):
+    data = lookup_trip(trip_id)
+    if data is None:
+        # Planned by another worker, or evicted: rebuild it from the link
+        if 'destination' not in request.args:
+            return redirect(url_for('index'))
+        data = trip_from_request(request.args)
+    return render_trip(data)
+
+def run_trip_job(job, starting_city, destination, days, budget, seed):
+    cached = lookup_trip(job.id)
+    if cached is not None:
+        # Already planned: replay the stages straight from the cache
+        job.publish('travel_info', cached['travel_info'])
+        job.publish('places', places_event(cached['places']))
+        for day in cached['itinerary']:
+            job.publish('day', day)
+    get_trip(starting_city, destination, days, budget, seed, progress=job.publish)
+    job.publish('done', {'trip_id': job.id, 'url': f"/trip/{job.id}?{urlencode(trip_params(starting_city, destination, days, budget, seed))}"})
+    return job.id
+
+@app.route('/api/trips', methods=['POST'])
+def submit_trip():
+    values = request.get_json(silent=True) or request.form
+    try:
+        starting_city = values['starting_city']
+        destination = values['destination']
+        days = int(values['days'])
+        budget = int(values['budget']) if values.get('budget') else None
+        seed = int(values.get('seed', 0))
+    except (KeyError, ValueError):
+        return jsonify({'error': 'starting_city, destination and days are required'}), 400
+    trip_id = make_trip_id(starting_city, destination, days, budget, seed)
+    finished = jobs.get(trip_id)
+    if finished is not None and finished.done and trip_id not in trips:
+        # The trip was evicted since this job ran, plan it again
+        jobs.discard(trip_id)
+    job = jobs.submit(trip_id, run_trip_job, starting_city, destination, days, budget, seed)
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('job_status', job_id=job.id),
+        'events_url': url_for('job_events', job_id=job.id),
+    }), 202
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    # Polling: returns the stages after ?since=N and the cursor for the next poll.
+    # Answers for jobs running on any worker process.
+    state = jobs.status(job_id, since=request.args.get('since', 0, type=int))
+    if state is None:
+        abort(404)
+    return jsonify(state)
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    # Server-Sent Events: one message per stage, resumable with Last-Event-ID.
+    # Only the worker running the job can stream it, and the stream holds a
+    # request worker until the job ends; the page polls job_status instead.
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    since = request.headers.get('Last-Event-ID', type=int)
+    since = since + 1 if since is not None else 0
+
+    def stream(since):
+        while True:
+            events = job.wait_events(since)
+            for event in events:
+                yield f"id: {since}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+                since += 1
+            if job.done and len(job.events) <= since:
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+
+    return Response(stream(since), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/download_pdf', methods=['POST'])
 def download_pdf():
-    starting_city = request.form['starting_city']
-    destination = request.form['destination']
-    days = int(request.form['days'])
-    data = scraper.scrape_all_data(starting_city, destination, days)
+    data = trip_from_request(request.form)
+    destination = data['destination']
     itinerary = data['itinerary']
     travel_info = data['travel_info']
-    html = render_template('itinerary.html', itinerary=itinerary, travel_info=travel_info, starting_city=starting_city, destination=destination, days=days)
-    pdf = io.BytesIO()
-    pisa.CreatePDF(io.StringIO(html), dest=pdf)
-    pdf.seek(0)
-    return send_file(pdf, as_attachment=True, download_name=f"itinerary_{destination}.pdf", mimetype='application/pdf')
+    html = render_template('itinerary.html', itinerary=itinerary, places=data['places'], travel_info=travel_info, starting_city=data['starting_city'], destination=destination, days=data['days'], budget=data['budget'])
+    try:
+        pdf = pdf_renderer.render(html)
+    except PDFBusyError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    return send_file(io.BytesIO(pdf), as_attachment=True, download_name=f"itinerary_{destination}.pdf", mimetype='application/pdf')
 
 @app.route('/map')
 def map_view():
-    destination = request.args.get('destination')
-    days = int(request.args.get('days', 1))
-    itinerary = generate_itinerary(destination, 0, days)
-    # Collect all places for all days
-    places = []
-    for day in itinerary:
-        for attr in day['attractions']:
-            places.append(attr)
-    return render_template('map.html', destination=destination, places=places)
+    # Links carry the trip parameters next to the id, so a worker that doesn't
+    # have the trip (or has evicted it) rebuilds the same one
+    data = trip_from_request(request.args)
+    params = trip_params(data['starting_city'], data['destination'], data['days'], data['budget'], data['seed'])
+    # The page draws everything from the trip's GeoJSON document
+    return render_template('map.html', destination=data['destination'], geojson_url=url_for('trip_geojson_view', trip_id=data['trip_id'], **params))
+
+@app.route('/api/trip/<trip_id>/geojson')
+def trip_geojson_view(trip_id):
+    cached = geojson_cache.get(trip_id)
+    metrics.cache_lookup('geojson', cached is not None)
+    if cached is None:
+        data = lookup_trip(trip_id)
+        if data is None:
+            if 'destination' not in request.args:
+                return jsonify({'error': 'unknown trip'}), 404
+            data = trip_from_request(request.args)
+        raw = json.dumps(trip_geojson(data['itinerary'], data['places']), separators=(',', ':')).encode('utf-8')
+        cached = {'raw': raw, 'gzip': gzip.compress(raw, compresslevel=6), 'etag': hashlib.sha1(raw).hexdigest()[:16]}
+        geojson_cache.set(data['trip_id'], cached)
+    headers = {'ETag': f'"{cached["etag"]}"', 'Cache-Control': 'private, max-age=3600', 'Vary': 'Accept-Encoding'}
+    if cached['etag'] in request.if_none_match:
+        return Response(status=304, headers=headers)
+    if 'gzip' in request.accept_encodings:
+        headers['Content-Encoding'] = 'gzip'
+        return Response(cached['gzip'], mimetype='application/geo+json', headers=headers)
+    return Response(cached['raw'], mimetype='application/geo+json', headers=headers)
 
 if __name__ == '__main__':
 
@@ -0,0 +1,88 @@
+"""Check that concurrent identical scrapes share their upstream fetches.
+
+Runs against the local stand-ins from ``fake_services.py``. First one trip is
+planned alone with an empty cache, which gives the Nominatim and Wikipedia
+request counts of a single place discovery. Then, with another empty cache,
+several worker processes (forked, like gunicorn workers) each plan the same
+destination from several threads at once, with different seeds. With
+``SingleFlight`` and the ``DiskCache.get_or_set`` leases working, the
+concurrent run makes no more Nominatim or Wikipedia requests than the single
+trip did. The script exits non-zero when it makes more.
+
+    python benchmarks/coalescing.py
+    python benchmarks/coalescing.py --processes 4 --threads 16 --latency wikipedia=80
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import FakeServices  # noqa: E402
+from run import parse_latency  # noqa: E402
+
+CHECKED = ('nominatim', 'wikipedia')
+
+
+def plan(worker, threads, destination, days, nominatim_rate):
+    # Runs in a worker process: one app instance, `threads` concurrent trips
+    import app
+    from rate_limiter import SharedTokenBucket
+    app.scraper.nominatim_limiter = SharedTokenBucket('nominatim', rate=nominatim_rate, capacity=nominatim_rate)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        trips = list(pool.map(lambda i: app.get_trip('Madrid', destination, days, None, seed=worker * 1000 + i), range(threads)))
+    return len(trips)
+
+
+def run(services, processes, threads, args):
+    os.environ['CACHE_DIR'] = tempfile.mkdtemp(prefix='travel-coalesce-')
+    services.reset_counts()
+    start = time.perf_counter()
+    context = multiprocessing.get_context('fork')
+    with context.Pool(processes) as pool:
+        planned = sum(pool.starmap(plan, [(w, threads, args.destination, args.days, args.nominatim_rate) for w in range(processes)]))
+    return planned, time.perf_counter() - start, services.snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--destination', default='Lisbon')
+    parser.add_argument('--days', type=int, default=2)
+    parser.add_argument('--latency', nargs='*', metavar='SERVICE=MS', help='per-service latency, e.g. wikipedia=50')
+    parser.add_argument('--nominatim-rate', type=float, default=50,
+                        help='shared Nominatim budget in req/s (the fake server has no limit)')
+    args = parser.parse_args()
+
+    latency = {'nominatim': 50, 'wikipedia': 50, 'osrm': 5}
+    latency.update(parse_latency(args.latency))
+    services = FakeServices(latency_ms=latency).start()
+    os.environ.update(services.env())
+    # Keep the run independent of any local POI index
+    os.environ['POI_INDEX_DIR'] = os.path.join(tempfile.mkdtemp(prefix='travel-coalesce-'), 'none')
+    os.chdir(ROOT)
+
+    _, single_s, single = run(services, 1, 1, args)
+    planned, concurrent_s, concurrent = run(services, args.processes, args.threads, args)
+    services.stop()
+
+    print(f"{'run':<28}{'trips':>6}{'seconds':>9}" + ''.join(f"{s:>11}" for s in CHECKED))
+    print(f"{'single trip':<28}{1:>6}{single_s:>9.2f}" + ''.join(f"{single.get(s, 0):>11}" for s in CHECKED))
+    label = f"{args.processes} processes x {args.threads} threads"
+    print(f"{label:<28}{planned:>6}{concurrent_s:>9.2f}" + ''.join(f"{concurrent.get(s, 0):>11}" for s in CHECKED))
+    extra = [s for s in CHECKED if concurrent.get(s, 0) > single.get(s, 0)]
+    if extra:
+        print(f"FAIL: concurrent trips repeated {', '.join(extra)} requests")
+        sys.exit(1)
+    print("OK: concurrent trips shared one place discovery and one geocode per place")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Local stand-ins for Nominatim, the MediaWiki API, OSRM and the Groq API.
+
+One threaded HTTP server answers all four under different path prefixes:
+
+    /nominatim/search           Nominatim search
+    /wikipedia/w/api.php        MediaWiki query API (list=search and prop=...)
+    /wikipedia/images/...       page images (a 1x1 PNG)
+    /osrm/route/v1/..., /osrm/table/v1/...
+    /llm/chat/completions       OpenAI-compatible chat completions (streaming too)
+
+Responses come from a recordings file when one matches the request (see
+``FakeServices.load_recordings``), otherwise they are generated
+deterministically from the request, so runs are reproducible. Every service
+can be given an artificial latency, and the server counts requests per
+service.
+"""
+import hashlib
+import json
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+SERVICES = ('nominatim', 'wikipedia', 'osrm', 'llm')
+
+
+def _unit(*parts):
+    # Deterministic float in [0, 1) from the given values
+    digest = hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2**64
+
+
+def _city_centre(name):
+    return 50 * _unit('lat', name) - 10, 60 * _unit('lon', name) - 10
+
+
+def _tiny_png():
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    header = struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(b'\x00\x4a\x90\xe2')) + chunk(b'IEND', b'')
+
+
+TINY_PNG = _tiny_png()
+
+
+def recording_key(service, path, params):
+    return f"{service} {path}?" + '&'.join(f"{k}={v}" for k, v in sorted(params.items()))
+
+
+class FakeServices:
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=None, recordings=None):
+        self.latency_ms = {name: 0 for name in SERVICES}
+        self.latency_ms.update(latency_ms or {})
+        self.recordings = dict(recordings or {})
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        # Environment variables that point the app at these services
+        return {
+            'NOMINATIM_URL': f"{self.base_url}/nominatim/search",
+            'WIKIPEDIA_API_URL': f"{self.base_url}/wikipedia/w/api.php",
+            'OSRM_URL': f"{self.base_url}/osrm",
+            'GROQ_API_URL': f"{self.base_url}/llm/chat/completions",
+            'GROQ_API_KEY': 'offline-benchmark',
+        }
+
+    def load_recordings(self, path):
+        # JSON object of recording_key(...) -> response body
+        with open(path) as f:
+            self.recordings.update(json.load(f))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self, body=None):
+                url = urlsplit(self.path)
+                service, _, path = url.path.lstrip('/').partition('/')
+                if service not in SERVICES:
+                    self.send_error(404)
+                    return
+                with services._lock:
+                    services.counts[service] += 1
+                time.sleep(services.latency_ms[service] / 1000)
+                if path.startswith('images/'):
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'image/png')
+                    self.send_header('Content-Length', str(len(TINY_PNG)))
+                    self.end_headers()
+                    self.wfile.write(TINY_PNG)
+                    return
+                params = dict(parse_qsl(url.query))
+                recorded = services.recordings.get(recording_key(service, '/' + path, params))
+                if service == 'llm':
+                    services._llm(self, body or {}, recorded)
+                    return
+                if recorded is None:
+                    recorded = getattr(services, f"_{service}")('/' + path, params)
+                self._send_json(recorded)
+
+            def _send_json(self, data, status=200):
+                raw = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_GET(self):
+                self._dispatch()
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                self._dispatch(body)
+
+        return Handler
+
+    def _nominatim(self, path, params):
+        query = params.get('q', '')
+        place, _, city = query.rpartition(', ')
+        lat, lon = _city_centre(city or place)
+        if place and place != city:
+            lat += 0.1 * _unit('dlat', query) - 0.05
+            lon += 0.1 * _unit('dlon', query) - 0.05
+        return [{'lat': str(lat), 'lon': str(lon), 'display_name': query}]
+
+    def _wikipedia(self, path, params):
+        if params.get('list') == 'search':
+            term = params.get('srsearch', '')
+            keyword, _, city = term.partition(' in ')
+            limit = int(params.get('srlimit', 10))
+            return {'query': {'search': [{'title': f"{city} {keyword.title()} {i + 1}"} for i in range(limit)]}}
+        pages = []
+        for title in params.get('titles', '').split('|'):
+            city = title.split(' ')[0]
+            lat, lon = _city_centre(city)
+            page = {
+                'title': title,
+                'extract': f"{title} is a well known place in {city}.",
+                'thumbnail': {'source': f"{self.base_url}/wikipedia/images/{hashlib.sha1(title.encode()).hexdigest()[:8]}.png"},
+            }
+            # Some pages have no coordinates, so the Nominatim fallback runs too
+            if _unit('coords', title) < 0.8:
+                page['coordinates'] = [{'lat': lat + 0.1 * _unit('dlat', title) - 0.05, 'lon': lon + 0.1 * _unit('dlon', title) - 0.05}]
+            pages.append(page)
+        return {'query': {'pages': pages}}
+
+    def _osrm(self, path, params):
+        # /route/v1/{profile}/{lon,lat;lon,lat} or /table/v1/{profile}/{lon,lat;...}
+        kind = path.split('/')[1]
+        coords = [tuple(float(v) for v in c.split(',')) for c in path.rsplit('/', 1)[1].split(';')]
+
+        def leg(a, b):
+            km = 111 * (abs(a[0] - b[0]) + abs(a[1] - b[1])) * 1.3
+            return km * 1000, km / 40 * 3600
+
+        if kind == 'route':
+            distance, duration = leg(coords[0], coords[1])
+            return {'code': 'Ok', 'routes': [{'distance': distance, 'duration': duration}]}
+        sources = [int(i) for i in params['sources'].split(';')] if 'sources' in params else range(len(coords))
+        destinations = [int(i) for i in params['destinations'].split(';')] if 'destinations' in params else range(len(coords))
+        distances = [[leg(coords[i], coords[j])[0] for j in destinations] for i in sources]
+        durations = [[leg(coords[i], coords[j])[1] for j in destinations] for i in sources]
+        return {'code': 'Ok', 'distances': distances, 'durations': durations}
+
+    def _llm(self, handler, body, recorded):
+        question = body.get('messages', [{}])[-1].get('content', '')
+        reply = recorded or f"Here is a helpful answer about your trip ({len(question)} characters of context)."
+        if not body.get('stream'):
+            handler._send_json({'choices': [{'message': {'role': 'assistant', 'content': reply}}]})
+            return
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+        words = reply.split(' ')
+        per_token = self.latency_ms['llm'] / 1000 / max(len(words), 1)
+        for i, word in enumerate(words):
+            delta = word if i == 0 else ' ' + word
+            chunk = f"data: {json.dumps({'choices': [{'delta': {'content': delta}}]})}\n\n".encode('utf-8')
+            handler.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            handler.wfile.flush()
+            time.sleep(per_token)
+        done = b"data: [DONE]\n\n"
+        handler.wfile.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
@@ -0,0 +1,178 @@
+"""Offline benchmark for the itinerary pipeline and the web endpoints.
+
+Starts the local stand-ins from ``fake_services.py``, points the app at them
+and measures:
+
+    scrape-cold / scrape-warm   scrape_all_data for each trip length; each length
+                                plans destinations no earlier scenario touched
+    concurrent                  POST / from many threads at once
+    chat / chat-cached          POST /chat (streamed) for a cached trip
+    pdf / pdf-cached            POST /download_pdf by trip id
+    map                         GET /map by trip id
+    map-geojson                 GET /api/trip/<id>/geojson (gzip), what the map page loads
+
+For each scenario it prints latency percentiles, throughput and how many
+requests reached each external service.
+
+    python benchmarks/run.py
+    python benchmarks/run.py --days 1 3 7 --destinations 6 --concurrency 16 \
+        --latency nominatim=150 wikipedia=80 osrm=40 llm=600 --json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import FakeServices, SERVICES  # noqa: E402
+
+DESTINATIONS = ['Lisbon', 'Kyoto', 'Cusco', 'Tbilisi', 'Hanoi', 'Seville', 'Bergen', 'Oaxaca', 'Krakow', 'Hobart']
+
+
+def destination_names(start, count):
+    # `count` destinations from position `start` on, numbered once the list runs out
+    names = []
+    for i in range(start, start + count):
+        name = DESTINATIONS[i % len(DESTINATIONS)]
+        names.append(f"{name} {i // len(DESTINATIONS) + 1}" if i >= len(DESTINATIONS) else name)
+    return names
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+class Recorder:
+    def __init__(self, services):
+        self.services = services
+        self.results = []
+
+    def run(self, name, calls, concurrency=1):
+        # calls: list of zero-argument callables, each one timed separately
+        self.services.reset_counts()
+        latencies = []
+
+        def timed(call):
+            t0 = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - t0)
+
+        start = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(timed, calls))
+        else:
+            for call in calls:
+                timed(call)
+        wall = time.perf_counter() - start
+        ms = [v * 1000 for v in latencies]
+        self.results.append({
+            'scenario': name,
+            'n': len(ms),
+            'p50_ms': percentile(ms, 50),
+            'p90_ms': percentile(ms, 90),
+            'p99_ms': percentile(ms, 99),
+            'max_ms': max(ms) if ms else 0.0,
+            'throughput_per_s': len(ms) / wall if wall else 0.0,
+            'upstream_requests': self.services.snapshot(),
+        })
+
+    def print_table(self):
+        header = f"{'scenario':<22}{'n':>4}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'req/s':>8}  " + '  '.join(f"{s:>9}" for s in SERVICES)
+        print(header)
+        print('-' * len(header))
+        for r in self.results:
+            upstream = '  '.join(f"{r['upstream_requests'].get(s, 0):>9}" for s in SERVICES)
+            print(f"{r['scenario']:<22}{r['n']:>4}{r['p50_ms']:>10.1f}{r['p90_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}{r['throughput_per_s']:>8.2f}  {upstream}")
+
+
+def parse_latency(values):
+    latency = {}
+    for item in values or []:
+        service, _, ms = item.partition('=')
+        if service not in SERVICES:
+            raise SystemExit(f"unknown service {service!r}, expected one of {', '.join(SERVICES)}")
+        latency[service] = float(ms)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 3, 5])
+    parser.add_argument('--destinations', type=int, default=3, help='trips per trip length')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', nargs='*', metavar='SERVICE=MS', help='per-service latency, e.g. osrm=40')
+    parser.add_argument('--recordings', help='JSON file of recorded upstream responses')
+    parser.add_argument('--nominatim-rate', type=float, default=None,
+                        help='override the 1 req/s Nominatim budget (the fake server has no limit)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    services = FakeServices(latency_ms=parse_latency(args.latency))
+    if args.recordings:
+        services.load_recordings(args.recordings)
+    services.start()
+    os.environ.update(services.env())
+    os.environ['CACHE_DIR'] = tempfile.mkdtemp(prefix='travel-bench-')
+    # Keep the run independent of any local POI index
+    os.environ['POI_INDEX_DIR'] = os.path.join(os.environ['CACHE_DIR'], 'no-poi-index')
+    os.chdir(ROOT)
+
+    import app  # noqa: E402 - must see the environment above
+    if args.nominatim_rate:
+        from rate_limiter import TokenBucket
+        app.scraper.nominatim_limiter = TokenBucket(rate=args.nominatim_rate, capacity=args.nominatim_rate)
+
+    client = app.app.test_client()
+    rec = Recorder(services)
+    # The geocode and places caches and the router's leg memo are shared by
+    # every scenario, so a cold run needs destinations nobody planned yet (the
+    # starting city's geocode is the only thing later lengths find cached)
+    trip_destinations = {days: destination_names(i * args.destinations, args.destinations) for i, days in enumerate(args.days)}
+    destinations = trip_destinations[args.days[0]]
+
+    for label in ('scrape-cold', 'scrape-warm'):
+        for days in args.days:
+            calls = [lambda d=d, days=days: app.scraper.scrape_all_data('Madrid', d, days) for d in trip_destinations[days]]
+            rec.run(f"{label} {days}d", calls)
+
+    # Distinct trips (new seeds) so the trip cache doesn't answer them
+    def form(i):
+        days = args.days[i % len(args.days)]
+        return {'starting_city': 'Madrid', 'destination': trip_destinations[days][i % args.destinations],
+                'days': str(days), 'budget': '50000', 'seed': str(1000 + i)}
+    rec.run(f"concurrent x{args.concurrency}",
+            [lambda i=i: client.post('/', data=form(i)) for i in range(args.concurrency * 2)],
+            concurrency=args.concurrency)
+
+    trip = app.get_trip('Madrid', destinations[0], max(args.days), 50000)
+    trip_id = trip['trip_id']
+    questions = [f"What should I pack for day {i + 1}?" for i in range(5)]
+    chat = lambda q: client.post('/chat', json={'message': q, 'trip_id': trip_id, 'stream': True}).get_data()
+    rec.run('chat', [lambda q=q: chat(q) for q in questions])
+    rec.run('chat-cached', [lambda q=q: chat(q) for q in questions])
+    pdf = lambda: client.post('/download_pdf', data={'trip_id': trip_id}).get_data()
+    rec.run('pdf', [pdf])
+    rec.run('pdf-cached', [pdf] * 5)
+    rec.run('map', [lambda: client.get(f"/map?trip_id={trip_id}").get_data()] * 5)
+    rec.run('map-geojson', [lambda: client.get(f"/api/trip/{trip_id}/geojson", headers={'Accept-Encoding': 'gzip'}).get_data()] * 5)
+
+    services.stop()
+    if args.json:
+        print(json.dumps(rec.results, indent=2))
+    else:
+        rec.print_table()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Cold-start benchmark for the web app.
+
+Imports ``app`` in fresh interpreters and reports how long the import takes
+and the resident memory of the process afterwards, which is roughly what
+every gunicorn worker pays before serving its first request.
+
+    python benchmarks/startup.py --runs 10
+    python benchmarks/startup.py --json > startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app
+elapsed = time.perf_counter() - t0
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+heavy = [m for m in ('langchain', 'xhtml2pdf', 'fake_useragent', 'wikipedia', 'bs4') if m in sys.modules]
+print(json.dumps({'import_s': elapsed, 'rss_kb': rss_kb(), 'heavy_modules': heavy}))
+"""
+
+
+def run_once(env):
+    out = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print raw results as JSON')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('CACHE_DIR', tempfile.mkdtemp(prefix='startup-bench-'))
+    results = [run_once(env) for _ in range(args.runs)]
+    import_times = [r['import_s'] * 1000 for r in results]
+    rss = [r['rss_kb'] / 1024 for r in results]
+    summary = {
+        'runs': args.runs,
+        'import_ms': {'min': min(import_times), 'median': statistics.median(import_times), 'max': max(import_times)},
+        'rss_mb': {'min': min(rss), 'median': statistics.median(rss), 'max': max(rss)},
+        'heavy_modules_loaded': results[-1]['heavy_modules'],
+    }
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"runs:          {args.runs}")
+    print(f"import app:    median {summary['import_ms']['median']:.0f} ms (min {summary['import_ms']['min']:.0f}, max {summary['import_ms']['max']:.0f})")
+    print(f"worker RSS:    median {summary['rss_mb']['median']:.1f} MB")
+    print(f"heavy modules: {', '.join(summary['heavy_modules_loaded']) or 'none'}")
+
+
+if __name__ == '__main__':
+    main()
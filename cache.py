@@ -0,0 +1,232 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+
+
+class SingleFlight:
+    # Collapses concurrent calls for the same key into one: the first caller
+    # runs fn, callers arriving while it runs wait for and share its result
+    # (or its exception)
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+        try:
+            value = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+class DiskCache:
+    # Small SQLite-backed key/value store shared by every worker process on
+    # the host. Values are stored as JSON. A value of None is a valid entry
+    # (negative result) and is kept for `negative_ttl` seconds instead of `ttl`.
+    MISS = object()
+
+    def __init__(self, name, ttl=30 * 24 * 3600, negative_ttl=24 * 3600, max_entries=50000, path=None):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, f"{name}.sqlite3")
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def _conn(self):
+        # sqlite3 connections can't be shared between threads or across a
+        # fork, so keep one per thread and reopen in forked worker processes.
+        # Nothing is opened until the first lookup.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT,"
+                " expires_at REAL NOT NULL,"
+                " stored_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_stored_at ON entries (stored_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                " key TEXT PRIMARY KEY,"
+                " owner TEXT NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, default=MISS):
+        try:
+            row = self._conn().execute(
+                "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error:
+            return default
+        if row is None or row[1] < time.time():
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        now = time.time()
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires_at, stored_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now),
+            )
+        except sqlite3.Error:
+            return
+        with self._lock:
+            self._writes += 1
+            should_evict = self._writes % 100 == 0
+        if should_evict:
+            self.evict()
+
+    def get_or_set(self, key, compute, ttl=None, lease_ttl=60, poll=0.1, cache_if=None):
+        # Cached value for key, computing it on a miss. Concurrent misses for
+        # the same key compute it once: threads of this process share one
+        # call, and other processes wait (up to lease_ttl) for the worker
+        # holding the key's lease to store the value. An exception from
+        # compute isn't cached; it reaches every caller that shared the call.
+        value = self.get(key)
+        if value is not self.MISS:
+            return value
+        return self._flight.do(key, lambda: self._fill(key, compute, ttl, lease_ttl, poll, cache_if))
+
+    def _fill(self, key, compute, ttl, lease_ttl, poll, cache_if):
+        deadline = time.monotonic() + lease_ttl
+        while True:
+            value = self.get(key)
+            if value is not self.MISS:
+                return value
+            owner = self._acquire_lease(key, lease_ttl)
+            # Past the deadline the lease holder is presumed stuck
+            if owner is not None or time.monotonic() >= deadline:
+                break
+            time.sleep(poll)
+        try:
+            value = compute()
+            if cache_if is None or cache_if(value):
+                self.set(key, value, ttl)
+            return value
+        finally:
+            if owner:
+                self._release_lease(key, owner)
+
+    def _acquire_lease(self, key, ttl):
+        # Returns an owner token if this caller now holds the lease, None if
+        # another holds it, '' if the database is unusable (just compute)
+        owner = uuid.uuid4().hex
+        now = time.time()
+        try:
+            cur = self._conn().execute(
+                "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at"
+                " WHERE leases.expires_at < ?",
+                (key, owner, now + ttl, now),
+            )
+        except sqlite3.Error:
+            return ''
+        return owner if cur.rowcount == 1 else None
+
+    def _release_lease(self, key, owner):
+        try:
+            self._conn().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+        except sqlite3.Error:
+            pass
+
+    def delete(self, key):
+        try:
+            self._conn().execute("DELETE FROM entries WHERE key = ?", (key,))
+        except sqlite3.Error:
+            pass
+
+    def evict(self):
+        # Drop expired rows, then the oldest rows above max_entries
+        try:
+            conn = self._conn()
+            conn.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),))
+            conn.execute("DELETE FROM leases WHERE expires_at < ?", (time.time(),))
+            count = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY stored_at LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+        except sqlite3.Error:
+            pass
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+class LRUCache:
+    # Thread-safe in-process cache with a size bound and an optional TTL
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def __contains__(self, key):
+        return self.get(key, DiskCache.MISS) is not DiskCache.MISS
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,85 @@
+CHARS_PER_TOKEN = 4  # rough average for English text with the Llama tokenizer
+
+STEP_LABELS = {'breakfast': 'breakfast', 'lunch': 'lunch', 'dinner': 'dinner'}
+PLACES_HEADING = "Places (id name (rating)):"
+SCHEDULE_HEADING = "Schedule (Nmin> = travel minutes from the previous stop):"
+
+
+def compact_itinerary(itinerary, travel_info=None, starting_city=None, destination=None, max_tokens=800, places=None):
+    # Plain-text summary of an itinerary for LLM prompts. Every place is
+    # listed once with a short id, and days are sequences of ids with travel
+    # minutes, so the hotel and repeated places don't cost tokens per mention.
+    # Days are added in order until the token budget is used up. Steps either
+    # carry their place dict or a place_id into `places` (a list of dicts).
+    header = []
+    if destination:
+        trip = f"Trip to {destination}"
+        if starting_city:
+            trip += f" from {starting_city}"
+        header.append(f"{trip}, {len(itinerary)} day(s).")
+    if travel_info:
+        header.append(f"Getting there: {travel_info.get('distance_km')} km, about {travel_info.get('duration_min')} min by {travel_info.get('mode', 'car')}.")
+
+    place_ids = {}
+    place_lines = []
+    day_blocks = []
+    for day in itinerary:
+        new_places = []
+        parts = []
+        for step in day.get('steps', []):
+            place = step.get('place')
+            if place is None and places and isinstance(step.get('place_id'), int) and 0 <= step['place_id'] < len(places):
+                place = places[step['place_id']]
+            place = place or {}
+            name = place.get('name')
+            if not name:
+                continue
+            if name not in place_ids:
+                place_ids[name] = f"P{len(place_ids) + 1}"
+                line = f"{place_ids[name]} {name}"
+                if place.get('rating'):
+                    line += f" ({place['rating']})"
+                new_places.append(line)
+            label = place_ids[name]
+            if step.get('type') in STEP_LABELS:
+                label += f" {STEP_LABELS[step['type']]}"
+            route = step.get('route')
+            if route:
+                label = f"{route.get('duration_min')}min> {label}"
+            parts.append(label)
+        day_blocks.append((new_places, f"Day {day.get('day')}: " + " -> ".join(parts)))
+
+    budget = max_tokens * CHARS_PER_TOKEN
+    used = sum(len(line) + 1 for line in header + [PLACES_HEADING, SCHEDULE_HEADING])
+    days_lines = []
+    included = 0
+    for new_places, day_line in day_blocks:
+        cost = sum(len(line) + 1 for line in new_places) + len(day_line) + 1
+        if used + cost > budget and included:
+            break
+        place_lines.extend(new_places)
+        days_lines.append(day_line)
+        used += cost
+        included += 1
+    if included < len(day_blocks):
+        days_lines.append(f"(Days {included + 1}-{len(day_blocks)} omitted for length.)")
+    # When even the first day is over budget, the schedule wins over the
+    # tail of the place list
+    schedule = []
+    if days_lines:
+        schedule.append(SCHEDULE_HEADING)
+        schedule.extend(days_lines)
+    room = budget - sum(len(line) + 1 for line in header + schedule)
+    places = []
+    if place_lines:
+        places.append(PLACES_HEADING)
+        for line in place_lines:
+            room -= len(line) + 1
+            if room < 0:
+                places.append("...")
+                break
+            places.append(line)
+    text = "\n".join(header + places + schedule)
+    if len(text) > budget:
+        text = text[:budget - 3].rsplit("\n", 1)[0] + "\n..."
+    return text
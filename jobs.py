@@ -0,0 +1,116 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import LRUCache
+
+
+class Job:
+    # A background pipeline run. Stages are appended to `events` as they
+    # complete; readers wait on the condition for anything past their cursor.
+    # With a store, every change is also written there so other worker
+    # processes can answer status polls for the job.
+    def __init__(self, job_id, store=None):
+        self.id = job_id
+        self.status = 'queued'
+        self.events = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self._store = store
+        self._cond = threading.Condition()
+        self._save()
+
+    def publish(self, event, data=None):
+        with self._cond:
+            self.events.append({'event': event, 'data': data})
+            self._cond.notify_all()
+        self._save()
+
+    def start(self):
+        self.status = 'running'
+        self._save()
+
+    def finish(self, status, result=None, error=None):
+        with self._cond:
+            self.status = status
+            self.result = result
+            self.error = error
+            self._cond.notify_all()
+        self._save()
+
+    def _save(self):
+        if self._store is not None:
+            self._store.set(self.id, self.to_dict())
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+    def wait_events(self, since=0, timeout=15):
+        # Events after `since`, blocking up to `timeout` seconds for new ones
+        with self._cond:
+            if len(self.events) <= since and not self.done:
+                self._cond.wait(timeout)
+            return self.events[since:]
+
+    def to_dict(self, since=0):
+        with self._cond:
+            events = self.events[since:]
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'events': events,
+                'next': since + len(events),
+                'error': self.error,
+            }
+
+
+class JobManager:
+    # Small worker pool for long-running trip pipelines. Jobs are keyed by a
+    # caller-supplied id, so resubmitting a queued or running trip joins it.
+    # `store` (a DiskCache) shares job state with the other worker processes.
+    def __init__(self, max_workers=4, max_jobs=1024, ttl=3600, store=None):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='trip-job')
+        self.jobs = LRUCache(maxsize=max_jobs, ttl=ttl)
+        self.store = store
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def status(self, job_id, since=0):
+        # Job state as Job.to_dict, for a job run by this process or, through
+        # the store, by another one. None if no worker knows the job.
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict(since=since)
+        state = self.store.get(job_id, None) if self.store is not None else None
+        if state is None:
+            return None
+        events = state['events'][since:]
+        return dict(state, events=events, next=since + len(events))
+
+    def discard(self, job_id):
+        self.jobs.pop(job_id)
+
+    def submit(self, job_id, fn, *args, **kwargs):
+        # fn(job, *args, **kwargs) publishes its own stages and returns the result
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.status != 'failed':
+                return job
+            job = Job(job_id, store=self.store)
+            self.jobs.set(job_id, job)
+        self.pool.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.start()
+        try:
+            result = fn(job, *args, **kwargs)
+        except Exception as e:
+            job.publish('error', {'message': str(e)})
+            job.finish('failed', error=str(e))
+            return
+        job.finish('done', result=result)
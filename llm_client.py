@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    pass
+
+
+class ChatClient:
+    # Client for an OpenAI-compatible chat completions API (Groq). Keeps one
+    # pooled session, retries connection errors and 429/5xx with exponential
+    # backoff, and caches complete replies by an exact hash of the request.
+    def __init__(self, api_url, api_key, model, timeout=30, max_retries=3, backoff=0.5, cache_size=512, cache_ttl=3600):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=16))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=16))
+
+    def _payload(self, messages, stream, **params):
+        payload = {'model': self.model, 'messages': messages, 'stream': stream}
+        payload.update(params)
+        return payload
+
+    def _cache_key(self, messages, params):
+        raw = json.dumps({'model': self.model, 'messages': messages, 'params': params}, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _post(self, payload, stream):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                # Timed up to the response headers; a streamed body arrives later
+                with metrics.upstream('llm'):
+                    resp = self.session.post(self.api_url, json=payload, headers=headers, timeout=self.timeout, stream=stream)
+            except requests.RequestException as e:
+                last_error = e
+                continue
+            if resp.status_code == 200:
+                return resp
+            metrics.upstream_errors_total.inc(service='llm')
+            last_error = LLMError(f"LLM API returned {resp.status_code}")
+            logger.warning("LLM API returned %s: %s", resp.status_code, resp.text[:200])
+            resp.close()
+            if resp.status_code not in RETRY_STATUSES:
+                break
+        raise LLMError(str(last_error))
+
+    def complete(self, messages, **params):
+        key = self._cache_key(messages, params)
+        reply = self.cache.get(key)
+        metrics.cache_lookup('chat', reply is not None)
+        if reply is not None:
+            return reply
+        resp = self._post(self._payload(messages, False, **params), stream=False)
+        reply = resp.json()['choices'][0]['message']['content']
+        if reply:
+            self.cache.set(key, reply)
+        return reply
+
+    def stream(self, messages, **params):
+        # Yields content deltas as the API produces them. Retries only happen
+        # before the first token; a finished reply is cached like complete().
+        key = self._cache_key(messages, params)
+        reply = self.cache.get(key)
+        metrics.cache_lookup('chat', reply is not None)
+        if reply is not None:
+            yield reply
+            return
+        resp = self._post(self._payload(messages, True, **params), stream=True)
+        parts = []
+        resp.encoding = 'utf-8'
+        with resp:
+            for line in resp.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                try:
+                    delta = json.loads(data)['choices'][0]['delta'].get('content')
+                except (ValueError, KeyError, IndexError):
+                    continue
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        # An empty stream isn't an answer worth repeating for an hour
+        if parts:
+            self.cache.set(key, ''.join(parts))
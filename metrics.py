@@ -0,0 +1,171 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers cache hits (sub-millisecond) up to slow cold scrapes
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_str(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_label_str(self.labelnames, key)} {value}"]
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, seconds, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    state['counts'][i] += 1
+            state['sum'] += seconds
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_value(self, key, state):
+        lines = []
+        bounds = [str(b) for b in self.buckets] + ['+Inf']
+        counts = state['counts'] + [state['count']]
+        for bound, count in zip(bounds, counts):
+            labels = _label_str(self.labelnames, key, [f'le="{bound}"'])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _label_str(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {state['sum']}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+REGISTRY = []
+
+http_request_seconds = Histogram('http_request_seconds', 'Time to produce a response, by endpoint', ['endpoint'])
+stage_seconds = Histogram('itinerary_stage_seconds', 'Time spent in each stage of building an itinerary (and rendering PDFs)', ['stage'])
+upstream_seconds = Histogram('upstream_request_seconds', 'Latency of calls to external services', ['service'])
+upstream_errors_total = Counter('upstream_errors_total', 'External service calls that failed', ['service'])
+cache_requests_total = Counter('cache_requests_total', 'Cache lookups by cache and result (hit/miss)', ['cache', 'result'])
+fallbacks_total = Counter('fallbacks_total', 'Times a degraded path was used instead of the primary one', ['kind'])
+
+
+def render():
+    # Prometheus text exposition format (0.0.4)
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def cache_lookup(cache, hit):
+    cache_requests_total.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+# Per-request breakdown: while a request is being handled, stage() and
+# upstream() also add their durations here (same thread only), so the
+# response can carry a Server-Timing header.
+_breakdown = contextvars.ContextVar('timing_breakdown', default=None)
+
+
+def start_breakdown():
+    return _breakdown.set({})
+
+
+def end_breakdown(token):
+    timings = _breakdown.get()
+    _breakdown.reset(token)
+    return timings or {}
+
+
+def _add_to_breakdown(name, seconds):
+    timings = _breakdown.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=name)
+        _add_to_breakdown(name, elapsed)
+
+
+@contextmanager
+def upstream(service):
+    # Times an external call and counts it as an error if it raises
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        upstream_errors_total.inc(service=service)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        upstream_seconds.observe(elapsed, service=service)
+        _add_to_breakdown(f"upstream_{service}", elapsed)
+
+
+def server_timing_header(timings):
+    return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
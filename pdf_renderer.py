@@ -0,0 +1,188 @@
+import hashlib
+import io
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+import requests
+
+import metrics
+from cache import CACHE_DIR
+
+IMG_SRC_RE = re.compile(r'(<img\b[^>]*?\bsrc=")(https?://[^"]+)(")', re.IGNORECASE)
+
+
+class PDFBusyError(Exception):
+    pass
+
+
+def _cached_image(url, image_dir, timeout=10):
+    # Download a remote image once; later renders (and other workers) reuse the file
+    ext = os.path.splitext(url.split('?', 1)[0])[1].lower()
+    if ext not in ('.jpg', '.jpeg', '.png', '.gif'):
+        ext = '.img'
+    path = os.path.join(image_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + ext)
+    if os.path.exists(path):
+        try:
+            os.utime(path)  # recently used, keep it when the cache is trimmed
+        except OSError:
+            pass
+        return path
+    try:
+        resp = requests.get(url, timeout=timeout, headers={'User-Agent': 'AI-Travel-Assistant PDF renderer'})
+        resp.raise_for_status()
+    except Exception:
+        return None
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(resp.content)
+    os.replace(tmp, path)
+    return path
+
+
+def _localize_images(html, image_dir):
+    urls = list(dict.fromkeys(m.group(2) for m in IMG_SRC_RE.finditer(html)))
+    if not urls:
+        return html
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        paths = dict(zip(urls, pool.map(lambda u: _cached_image(u, image_dir), urls)))
+    return IMG_SRC_RE.sub(lambda m: m.group(1) + (paths.get(m.group(2)) or m.group(2)) + m.group(3), html)
+
+
+def _render(html, image_dir):
+    # Runs in a worker process: xhtml2pdf is CPU bound and holds the GIL
+    from xhtml2pdf import pisa
+    html = _localize_images(html, image_dir)
+    pdf = io.BytesIO()
+    # Relative paths (and newer xhtml2pdf's local file policy) are anchored at
+    # `path`'s directory, which is where the localized images live
+    pisa.CreatePDF(io.StringIO(html), dest=pdf, path=os.path.join(image_dir, 'itinerary.html'))
+    return pdf.getvalue()
+
+
+class PDFRenderer:
+    # Renders HTML to PDF in a process pool. At most `max_pending` renders are
+    # queued or running at once; beyond that render() raises PDFBusyError
+    # instead of piling up work. Finished PDFs are kept on disk by a hash of
+    # the HTML, so repeat downloads skip rendering entirely.
+    def __init__(self, max_workers=2, max_pending=8, max_files=500, max_images=2000, cache_dir=None):
+        self.max_workers = max_workers
+        self.max_files = max_files
+        self.max_images = max_images
+        self.cache_dir = cache_dir or os.path.join(CACHE_DIR, 'pdf')
+        self.image_dir = os.path.join(self.cache_dir, 'images')
+        os.makedirs(self.image_dir, exist_ok=True)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._inflight = {}
+        self._lock = threading.RLock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn: the app process has threads, forking it isn't safe
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _discard(self, pool):
+        # Drop a broken pool; the next render starts a new one
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pdf")
+
+    def render(self, html, timeout=120):
+        key = hashlib.sha256(html.encode('utf-8')).hexdigest()
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                pdf = f.read()
+            metrics.cache_lookup('pdf', True)
+            return pdf
+        except FileNotFoundError:
+            metrics.cache_lookup('pdf', False)
+        # A render process that dies (OOM kill, crash in the PDF library)
+        # breaks the whole pool: replace it and try once more
+        for attempt in range(2):
+            try:
+                future, pool = self._submit(key, html)
+            except BrokenProcessPool:
+                continue  # _submit already dropped the pool
+            with metrics.stage('pdf_render'):
+                try:
+                    return future.result(timeout=timeout)
+                except FutureTimeout:
+                    # The render carries on and is cached, so a retry can succeed
+                    raise PDFBusyError("Generating the PDF is taking longer than usual, try again shortly")
+                except BrokenProcessPool:
+                    self._forget(key, future)
+                    self._discard(pool)
+        raise PDFBusyError("The PDF renderer is restarting, try again shortly")
+
+    def _submit(self, key, html):
+        # The in-flight render of this HTML and its pool, starting one if needed
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is None:
+                # Nobody is rendering this HTML yet
+                if not self._slots.acquire(blocking=False):
+                    raise PDFBusyError("Too many PDFs are being generated, try again shortly")
+                pool = self._executor()
+                try:
+                    future = pool.submit(_render, html, self.image_dir)
+                except BrokenProcessPool:
+                    self._slots.release()
+                    self._discard(pool)
+                    raise
+                except Exception:
+                    self._slots.release()
+                    raise
+                entry = self._inflight[key] = (future, pool)
+                future.add_done_callback(lambda f: self._finished(key, f))
+            return entry
+
+    def _finished(self, key, future):
+        # Store the PDF before dropping the in-flight entry, so a new request
+        # for the same HTML either joins the render or finds the file
+        try:
+            if not future.cancelled() and future.exception() is None:
+                tmp = f"{self._path(key)}.{os.getpid()}.tmp"
+                with open(tmp, 'wb') as f:
+                    f.write(future.result())
+                os.replace(tmp, self._path(key))
+                self._trim()
+        except OSError:
+            pass
+        finally:
+            self._forget(key, future)
+            self._slots.release()
+
+    def _forget(self, key, future):
+        # Drop the in-flight entry if it is still this render's
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is not None and entry[0] is future:
+                del self._inflight[key]
+
+    def _trim(self):
+        # Keep the newest max_files PDFs and max_images downloaded images
+        self._trim_dir(self.cache_dir, self.max_files, lambda n: n.endswith('.pdf'))
+        self._trim_dir(self.image_dir, self.max_images, lambda n: not n.endswith('.tmp'))
+
+    @staticmethod
+    def _trim_dir(path, keep, wanted):
+        try:
+            files = [os.path.join(path, n) for n in os.listdir(path) if wanted(n)]
+            if len(files) <= keep:
+                return
+            files.sort(key=os.path.getmtime)
+            for name in files[:len(files) - keep]:
+                os.remove(name)
+        except OSError:
+            pass
@@ -0,0 +1,115 @@
+class Place:
+    # One place of a trip. Slots keep the per-place cost of cached trips small.
+    __slots__ = ('id', 'name', 'category', 'lat', 'lon', 'image_url', 'rating', 'location')
+
+    FIELDS = ('name', 'category', 'lat', 'lon', 'image_url', 'rating', 'location')
+
+    def __init__(self, id, name, category=None, lat=None, lon=None, image_url=None, rating=None, location=None):
+        self.id = id
+        self.name = name
+        self.category = category
+        self.lat = lat
+        self.lon = lon
+        self.image_url = image_url
+        self.rating = rating
+        self.location = location
+
+    def to_dict(self):
+        data = {'id': self.id}
+        for field in self.FIELDS:
+            data[field] = getattr(self, field)
+        return data
+
+    def __repr__(self):
+        return f"Place({self.id}, {self.name!r})"
+
+
+class PlaceTable:
+    # The places of one trip, each stored once. A place's id is its position
+    # in the table; itinerary steps refer to places by id.
+    def __init__(self):
+        self._places = []
+
+    def add(self, name, category=None, **fields):
+        place = Place(len(self._places), name, category, **fields)
+        self._places.append(place)
+        return place.id
+
+    def add_dict(self, data, category=None):
+        # Add a place dict as produced by the scraper
+        fields = {field: data.get(field) for field in Place.FIELDS if field not in ('name', 'category')}
+        return self.add(data['name'], category or data.get('category'), **fields)
+
+    def __getitem__(self, place_id):
+        return self._places[place_id]
+
+    def __iter__(self):
+        return iter(self._places)
+
+    def __len__(self):
+        return len(self._places)
+
+    def to_list(self):
+        return [place.to_dict() for place in self._places]
+
+    def ids_by_category(self):
+        ids = {}
+        for place in self._places:
+            ids.setdefault(place.category, []).append(place.id)
+        return ids
+
+
+# Serializers: trips keep steps as {'type', 'place_id', 'route', 'note'}.
+# Templates look places up in the table; JSON consumers (the browser, chat,
+# job progress) get the table as a list next to the days.
+
+def trip_json(itinerary, places):
+    # Normalized form for the browser and chat: every place once, steps by id
+    return {'places': places.to_list(), 'itinerary': itinerary}
+
+
+def places_event(places):
+    # Payload of the 'places' progress event: the table plus ids per category
+    return dict(places.ids_by_category(), places=places.to_list())
+
+
+def trip_geojson(itinerary, places):
+    # FeatureCollection for the map: one Point per place on the itinerary and
+    # one LineString per day through its stops in visiting order. Lines are
+    # straight segments between stops; only leg durations and distances are
+    # known, not road geometry.
+    features = []
+    days_by_place = {}
+    for day in itinerary:
+        coords = []
+        duration = distance = 0
+        for step in day['steps']:
+            place = places[step['place_id']]
+            days = days_by_place.setdefault(place.id, [])
+            if day['day'] not in days:
+                days.append(day['day'])
+            if place.lat is not None and place.lon is not None:
+                coords.append([round(place.lon, 6), round(place.lat, 6)])
+            route = step.get('route')
+            if route:
+                duration += route.get('duration_min') or 0
+                distance += route.get('distance_km') or 0
+        if len(coords) > 1:
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'LineString', 'coordinates': coords},
+                'properties': {'kind': 'route', 'day': day['day'], 'duration_min': duration, 'distance_km': round(distance, 1)},
+            })
+    for place_id, days in days_by_place.items():
+        place = places[place_id]
+        if place.lat is None or place.lon is None:
+            continue
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [round(place.lon, 6), round(place.lat, 6)]},
+            'properties': {
+                'kind': 'place', 'id': place.id, 'name': place.name, 'category': place.category,
+                'rating': place.rating, 'image_url': place.image_url, 'days': days,
+            },
+        })
+    return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,172 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+ATTRACTIONS_PER_DAY = 5
+MORNING_ATTRACTIONS = 3
+
+
+def haversine_matrix(lats, lons):
+    # Pairwise great circle distances (km) between all points in one pass
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lon = np.radians(np.asarray(lons, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat/2)**2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon/2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def path_cost(cost, path):
+    path = np.asarray(path)
+    return float(cost[path[:-1], path[1:]].sum())
+
+
+def nearest_neighbour(cost, start, stops):
+    order = []
+    remaining = list(stops)
+    current = start
+    while remaining:
+        nxt = min(remaining, key=lambda s: cost[current, s])
+        order.append(nxt)
+        remaining.remove(nxt)
+        current = nxt
+    return order
+
+
+def two_opt(cost, path, fixed_end):
+    # Reverse segments while it shortens the path. The first node is always
+    # fixed, the last one too when the path has to end somewhere specific.
+    # Costs may be asymmetric (OSRM durations), so whole paths are compared.
+    best = list(path)
+    best_cost = path_cost(cost, best)
+    last = len(best) - 1 if fixed_end else len(best)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, last - 1):
+            for j in range(i + 1, last):
+                candidate = best[:i] + best[i:j+1][::-1] + best[j+1:]
+                candidate_cost = path_cost(cost, candidate)
+                if candidate_cost < best_cost - 1e-9:
+                    best, best_cost = candidate, candidate_cost
+                    improved = True
+    return best
+
+
+def or_opt(cost, path, fixed_end, max_segment=3):
+    # Move runs of up to max_segment consecutive stops to a better position
+    best = list(path)
+    best_cost = path_cost(cost, best)
+    last = len(best) - 1 if fixed_end else len(best)
+    improved = True
+    while improved:
+        improved = False
+        for length in range(1, max_segment + 1):
+            for i in range(1, last - length + 1):
+                segment = best[i:i+length]
+                rest = best[:i] + best[i+length:]
+                rest_last = len(rest) - 1 if fixed_end else len(rest)
+                for k in range(1, rest_last + 1):
+                    if k == i:
+                        continue
+                    candidate = rest[:k] + segment + rest[k:]
+                    candidate_cost = path_cost(cost, candidate)
+                    if candidate_cost < best_cost - 1e-9:
+                        best, best_cost = candidate, candidate_cost
+                        improved = True
+                        break
+                if improved:
+                    break
+            if improved:
+                break
+    return best
+
+
+def order_stops(cost, start, stops, end=None):
+    # Order stops to minimise the cost of start -> stops -> end (end optional)
+    if len(stops) < 2:
+        return list(stops)
+    path = [start] + nearest_neighbour(cost, start, stops)
+    fixed_end = end is not None
+    if fixed_end:
+        path.append(end)
+    while True:
+        before = path_cost(cost, path)
+        path = or_opt(cost, two_opt(cost, path, fixed_end), fixed_end)
+        if path_cost(cost, path) >= before - 1e-9:
+            break
+    return path[1:-1] if fixed_end else path[1:]
+
+
+def _best_insertion(cost, candidates, before, after):
+    # Candidate with the smallest detour between two anchors (after may be None)
+    candidates = np.asarray(candidates)
+    detour = cost[before, candidates].copy()
+    if after is not None:
+        detour += cost[candidates, after]
+    return int(candidates[int(np.argmin(detour))])
+
+
+def _take_unused(pool, used):
+    unused = [i for i in pool if i not in used]
+    if not unused:
+        used.clear()
+        unused = list(pool)
+    return unused
+
+
+def plan_days(cost, days, hotels, attractions, restaurants, origin=None):
+    # cost: square matrix over all places; hotels/attractions/restaurants are
+    # row indices into it, origin is the destination centre (used when there is
+    # no hotel). Returns, per day, a dict of indices:
+    # {'hotel', 'breakfast', 'morning', 'lunch', 'afternoon', 'dinner'}.
+    hotel = None
+    if hotels:
+        if attractions:
+            # The hotel closest (both ways) to all the attractions
+            hotel = min(hotels, key=lambda h: float(cost[h, attractions].sum() + cost[attractions, h].sum()))
+        else:
+            hotel = hotels[0]
+    base = hotel if hotel is not None else origin
+    used_attractions = set()
+    used_restaurants = set()
+    plan = []
+    for _ in range(days):
+        chosen = []
+        if attractions:
+            unused = _take_unused(attractions, used_attractions)
+            if base is not None:
+                seed = min(unused, key=lambda a: cost[base, a])
+            else:
+                seed = unused[0]
+            # Cluster the day around the seed: its nearest unused neighbours
+            # first, topped up with already visited ones on short lists
+            pool = np.asarray(attractions)
+            visited = np.array([a in used_attractions for a in attractions])
+            nearest = pool[np.lexsort((cost[seed, pool], visited))]
+            chosen = [int(i) for i in nearest[:ATTRACTIONS_PER_DAY]]
+            if base is not None:
+                chosen = order_stops(cost, base, chosen, end=hotel)
+            else:
+                chosen = [chosen[0]] + order_stops(cost, chosen[0], chosen[1:])
+            used_attractions.update(chosen)
+        morning = chosen[:MORNING_ATTRACTIONS]
+        afternoon = chosen[MORNING_ATTRACTIONS:]
+        day = {'hotel': hotel, 'breakfast': None, 'morning': morning, 'lunch': None, 'afternoon': afternoon, 'dinner': None}
+        if restaurants:
+            today = set()
+            slots = (
+                ('breakfast', base, chosen[0] if chosen else None),
+                ('lunch', morning[-1] if morning else base, afternoon[0] if afternoon else None),
+                ('dinner', chosen[-1] if chosen else base, hotel),
+            )
+            for meal, before, after in slots:
+                candidates = [r for r in _take_unused(restaurants, used_restaurants) if r not in today]
+                if not candidates:
+                    candidates = [r for r in restaurants if r not in today] or list(restaurants)
+                if before is None:
+                    before = after if after is not None else candidates[0]
+                day[meal] = _best_insertion(cost, candidates, before, after)
+                today.add(day[meal])
+                used_restaurants.add(day[meal])
+        plan.append(day)
+    return plan
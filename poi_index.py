@@ -0,0 +1,318 @@
+import argparse
+import csv
+import gzip
+import json
+import os
+import shutil
+import sys
+import threading
+from math import cos, radians
+from urllib.parse import quote
+
+import numpy as np
+
+POI_INDEX_DIR = os.getenv("POI_INDEX_DIR", os.path.join("data", "poi"))
+DEFAULT_CELL_DEG = 0.05  # ~5.5 km grid cells at the equator
+CATEGORIES = ('hotels', 'attractions', 'restaurants')
+INDEX_VERSION = 1
+
+# How dump records map onto CATEGORIES
+WIKIVOYAGE_TYPES = {
+    'sleep': 'hotels',
+    'see': 'attractions', 'do': 'attractions',
+    'eat': 'restaurants', 'drink': 'restaurants',
+}
+OSM_TAGS = {
+    'tourism': {
+        'hotel': 'hotels', 'hostel': 'hotels', 'guest_house': 'hotels', 'motel': 'hotels', 'apartment': 'hotels',
+        'attraction': 'attractions', 'museum': 'attractions', 'viewpoint': 'attractions', 'gallery': 'attractions',
+        'zoo': 'attractions', 'theme_park': 'attractions', 'aquarium': 'attractions', 'artwork': 'attractions',
+    },
+    'leisure': {'resort': 'hotels', 'park': 'attractions', 'garden': 'attractions'},
+    'amenity': {'restaurant': 'restaurants', 'cafe': 'restaurants', 'food_court': 'restaurants', 'pub': 'restaurants', 'bar': 'restaurants'},
+}
+CATEGORY_ALIASES = {'hotel': 'hotels', 'attraction': 'attractions', 'restaurant': 'restaurants'}
+
+
+def _grid_shape(cell_deg):
+    return int(np.ceil(180 / cell_deg)), int(np.ceil(360 / cell_deg))
+
+
+def _cell_keys(lats, lons, cell_deg):
+    # Row-major grid key, so the cells of one grid row are contiguous keys
+    rows, cols = _grid_shape(cell_deg)
+    row = np.clip(((np.asarray(lats) + 90) // cell_deg).astype(np.int64), 0, rows - 1)
+    col = np.clip(((np.asarray(lons) + 180) // cell_deg).astype(np.int64), 0, cols - 1)
+    return row * cols + col
+
+
+class POIIndex:
+    # Read-only places of interest on disk, grouped by grid cell. Every array
+    # is memory-mapped, so worker processes share the pages and opening the
+    # index costs next to nothing. Records are sorted by cell key, which turns
+    # a radius query into one binary search per grid row plus a distance
+    # filter over the candidates.
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"{path}: unsupported POI index version {meta.get('version')}")
+        self.path = path
+        self.cell_deg = meta['cell_deg']
+        self.categories = tuple(meta['categories'])
+        self.size = meta['count']
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+        self.keys = load('keys')
+        self.lat = load('lat')
+        self.lon = load('lon')
+        self.category = load('category')
+        self.rating = load('rating')
+        self._names = (load('name_offsets'), self._blob('names.bin'))
+        self._images = (load('image_offsets'), self._blob('images.bin'))
+
+    def _blob(self, name):
+        path = os.path.join(self.path, name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def _string(strings, i):
+        offsets, blob = strings
+        return bytes(blob[offsets[i]:offsets[i + 1]]).decode('utf-8')
+
+    def _candidates(self, lat, lon, radius_km):
+        rows, cols = _grid_shape(self.cell_deg)
+        dlat = radius_km / 111.2
+        dlon = radius_km / (111.2 * max(cos(radians(lat)), 0.01))
+        row_lo = max(int((lat - dlat + 90) // self.cell_deg), 0)
+        row_hi = min(int((lat + dlat + 90) // self.cell_deg), rows - 1)
+        col_lo = int((lon - dlon + 180) // self.cell_deg)
+        col_hi = int((lon + dlon + 180) // self.cell_deg)
+        if col_hi - col_lo + 1 >= cols:
+            spans = [(0, cols - 1)]
+        elif col_lo < 0:
+            # Crosses the antimeridian
+            spans = [(0, col_hi), (col_lo + cols, cols - 1)]
+        elif col_hi >= cols:
+            spans = [(col_lo, cols - 1), (0, col_hi - cols)]
+        else:
+            spans = [(col_lo, col_hi)]
+        slices = []
+        for row in range(row_lo, row_hi + 1):
+            for first, last in spans:
+                lo = np.searchsorted(self.keys, row * cols + first, side='left')
+                hi = np.searchsorted(self.keys, row * cols + last, side='right')
+                if hi > lo:
+                    slices.append(np.arange(lo, hi))
+        return np.concatenate(slices) if slices else np.zeros(0, dtype=np.int64)
+
+    def nearby(self, lat, lon, radius_km, category=None, limit=None):
+        # Places within radius_km of (lat, lon), nearest first
+        if category is not None:
+            if category not in self.categories:
+                return []
+            code = self.categories.index(category)
+        idx = self._candidates(lat, lon, radius_km)
+        if category is not None and len(idx):
+            idx = idx[self.category[idx] == code]
+        if not len(idx):
+            return []
+        lat1, lon1 = np.radians(lat), np.radians(lon)
+        lat2, lon2 = np.radians(self.lat[idx]), np.radians(self.lon[idx])
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        dist = 2 * 6371 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        inside = dist <= radius_km
+        idx, dist = idx[inside], dist[inside]
+        order = np.argsort(dist, kind='stable')[:limit]
+        return [self._record(int(idx[k]), float(dist[k])) for k in order]
+
+    def _record(self, i, distance_km):
+        rating = float(self.rating[i])
+        return {
+            'name': self._string(self._names, i),
+            'category': self.categories[self.category[i]],
+            'lat': float(self.lat[i]),
+            'lon': float(self.lon[i]),
+            'image_url': self._string(self._images, i) or None,
+            'rating': None if np.isnan(rating) else rating,
+            'distance_km': round(distance_km, 3),
+        }
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_index():
+    # The index at POI_INDEX_DIR, opened once per process; None when no index
+    # has been built, in which case callers go to the live sources
+    global _default
+    with _default_lock:
+        if _default is None:
+            if os.path.exists(os.path.join(POI_INDEX_DIR, 'meta.json')):
+                _default = POIIndex(POI_INDEX_DIR)
+            else:
+                _default = False
+        return _default or None
+
+
+# -- Importer -----------------------------------------------------------------
+
+def _commons_url(filename):
+    filename = filename.strip()
+    if filename.lower().startswith('file:'):
+        filename = filename[5:]
+    return "https://commons.wikimedia.org/wiki/Special:FilePath/" + quote(filename.replace(' ', '_'))
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def classify(props):
+    # Category for a dump record: an explicit category, a Wikivoyage listing
+    # type or OSM tags, in that order
+    category = str(props.get('category') or '').lower()
+    category = CATEGORY_ALIASES.get(category, category)
+    if category in CATEGORIES:
+        return category
+    listing_type = str(props.get('type') or '').lower()
+    if listing_type in WIKIVOYAGE_TYPES:
+        return WIKIVOYAGE_TYPES[listing_type]
+    tags = props.get('tags') if isinstance(props.get('tags'), dict) else props
+    for key, values in OSM_TAGS.items():
+        if tags.get(key) in values:
+            return values[tags[key]]
+    if tags.get('historic'):
+        return 'attractions'
+    return None
+
+
+def normalize(props, lat=None, lon=None):
+    # One dump record -> (name, category, lat, lon, image_url, rating), or
+    # None for records that aren't usable places
+    tags = props.get('tags') if isinstance(props.get('tags'), dict) else {}
+    name = props.get('name') or props.get('title') or tags.get('name')
+    category = classify(props)
+    if lat is None:
+        lat = _float(props.get('lat', props.get('latitude')))
+        lon = _float(props.get('lon', props.get('long', props.get('lng', props.get('longitude')))))
+    if not name or category is None or lat is None or lon is None:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    image = props.get('image_url') or props.get('image') or tags.get('image') or ''
+    commons = props.get('wikimedia_commons') or tags.get('wikimedia_commons')
+    if image and not image.startswith(('http://', 'https://')):
+        image = _commons_url(image)  # Wikivoyage listings give a Commons file name
+    elif not image and commons and commons.lower().startswith('file:'):
+        image = _commons_url(commons)
+    rating = _float(props.get('rating'))
+    return name.strip(), category, lat, lon, image, rating
+
+
+def read_records(path):
+    # CSV (e.g. a Wikivoyage listings export), JSON lines / GeoJSON sequence,
+    # or a GeoJSON FeatureCollection (e.g. an osmium export of OSM points)
+    opener = gzip.open if path.endswith('.gz') else open
+    base = path[:-3] if path.endswith('.gz') else path
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        if base.endswith('.csv'):
+            for row in csv.DictReader(f):
+                record = normalize(row)
+                if record:
+                    yield record
+            return
+        if base.endswith(('.geojson', '.json')):
+            features = json.load(f).get('features', [])
+        else:
+            features = (json.loads(line.lstrip('\x1e')) for line in f if line.strip())
+        for feature in features:
+            if feature.get('type') == 'Feature':
+                geometry = feature.get('geometry') or {}
+                if geometry.get('type') != 'Point':
+                    continue
+                lon, lat = geometry['coordinates'][:2]
+                record = normalize(feature.get('properties') or {}, float(lat), float(lon))
+            else:
+                record = normalize(feature)
+            if record:
+                yield record
+
+
+def _write_strings(out_dir, name, values):
+    encoded = [v.encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(os.path.join(out_dir, f"{name}_offsets.npy"), offsets)
+    with open(os.path.join(out_dir, f"{name}s.bin"), 'wb') as f:
+        for b in encoded:
+            f.write(b)
+
+
+def build_index(records, out_dir, cell_deg=DEFAULT_CELL_DEG):
+    # records: iterable of normalize() tuples. Duplicates (same name and
+    # category within ~100 m) keep the first record. The index is written
+    # into a temporary directory and swapped in, so readers never see a
+    # half-written index.
+    names, cats, lats, lons, images, ratings = [], [], [], [], [], []
+    seen = set()
+    for name, category, lat, lon, image, rating in records:
+        dedupe = (name.lower(), category, round(lat, 3), round(lon, 3))
+        if dedupe in seen:
+            continue
+        seen.add(dedupe)
+        names.append(name)
+        cats.append(CATEGORIES.index(category))
+        lats.append(lat)
+        lons.append(lon)
+        images.append(image or '')
+        ratings.append(np.nan if rating is None else rating)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    keys = _cell_keys(lats, lons, cell_deg)
+    order = np.argsort(keys, kind='stable')
+
+    tmp_dir = f"{out_dir.rstrip(os.sep)}.tmp{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.save(os.path.join(tmp_dir, 'keys.npy'), keys[order])
+    np.save(os.path.join(tmp_dir, 'lat.npy'), lats[order])
+    np.save(os.path.join(tmp_dir, 'lon.npy'), lons[order])
+    np.save(os.path.join(tmp_dir, 'category.npy'), np.asarray(cats, dtype=np.uint8)[order])
+    np.save(os.path.join(tmp_dir, 'rating.npy'), np.asarray(ratings, dtype=np.float32)[order])
+    _write_strings(tmp_dir, 'name', [names[i] for i in order])
+    _write_strings(tmp_dir, 'image', [images[i] for i in order])
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'cell_deg': cell_deg, 'categories': list(CATEGORIES), 'count': len(names)}, f)
+
+    if os.path.exists(out_dir):
+        old_dir = f"{out_dir.rstrip(os.sep)}.old{os.getpid()}"
+        os.replace(out_dir, old_dir)
+        os.replace(tmp_dir, out_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(out_dir)), exist_ok=True)
+        os.replace(tmp_dir, out_dir)
+    return len(names)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the local POI index from place dumps.")
+    parser.add_argument('inputs', nargs='+', help='.csv, .jsonl/.geojsonseq or .geojson files (optionally .gz)')
+    parser.add_argument('--out', default=POI_INDEX_DIR, help=f"index directory (default: {POI_INDEX_DIR})")
+    parser.add_argument('--cell-deg', type=float, default=DEFAULT_CELL_DEG, help='grid cell size in degrees')
+    args = parser.parse_args(argv)
+    records = (record for path in args.inputs for record in read_records(path))
+    count = build_index(records, args.out, args.cell_deg)
+    print(f"indexed {count} places into {args.out}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class TokenBucket:
+    # Thread-safe token bucket. acquire() returns immediately while tokens are
+    # available and only sleeps once the budget for the window is used up.
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)  # tokens added per second
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens=1):
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedTokenBucket:
+    # Token bucket whose state lives in a SQLite file, so every worker process
+    # on the host draws from one budget (N gunicorn workers still make at most
+    # `rate` requests per second together). Each acquire is one short write
+    # transaction. If the database can't be used, it falls back to a
+    # per-process bucket.
+    def __init__(self, name, rate, capacity=1, path=None):
+        if path is None:
+            from cache import CACHE_DIR
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, "ratelimit.sqlite3")
+        self.name = name
+        self.path = path
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._local = threading.local()
+        self._fallback = TokenBucket(rate, capacity)
+
+    def _conn(self):
+        # One connection per thread, reopened in forked worker processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " name TEXT PRIMARY KEY,"
+                " tokens REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _take(self, tokens):
+        # Takes tokens if available; returns the seconds to wait otherwise (0 on success)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (self.name,)).fetchone()
+            available = self.capacity if row is None else min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+            wait = 0.0
+            if available >= tokens:
+                available -= tokens
+            else:
+                wait = (tokens - available) / self.rate
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (self.name, available, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def try_acquire(self, tokens=1):
+        try:
+            return self._take(tokens) == 0
+        except sqlite3.Error:
+            return self._fallback.try_acquire(tokens)
+
+    def acquire(self, tokens=1):
+        while True:
+            try:
+                wait = self._take(tokens)
+            except sqlite3.Error:
+                self._fallback.acquire(tokens)
+                return
+            if wait == 0:
+                return
+            time.sleep(wait)
@@ -0,0 +1,164 @@
+import os
+import threading
+from collections import OrderedDict
+from math import radians, cos, sin, asin, sqrt
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from planner import haversine_matrix
+
+OSRM_URL = os.getenv("OSRM_URL", "http://router.project-osrm.org")
+OSRM_TIMEOUT = float(os.getenv("OSRM_TIMEOUT", 10))
+OSRM_TABLE_MAX_COORDS = 100  # default --max-table-size of osrm-routed
+FALLBACK_SPEED_KMH = 50
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    # Calculate the great circle distance between two points
+    R = 6371  # Earth radius in km
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
+    c = 2 * asin(sqrt(a))
+    return R * c
+
+
+def estimate_leg(start, end, mode='car'):
+    dist = haversine(start[0], start[1], end[0], end[1])
+    return {'mode': mode, 'duration_min': int(dist/FALLBACK_SPEED_KMH*60), 'distance_km': round(dist, 1)}
+
+
+class Router:
+    # OSRM client. prefetch() loads one table (distance matrix) for every
+    # candidate place of a trip, after which route() is answered from the
+    # memo. Legs the router can't produce fall back to a haversine estimate.
+    def __init__(self, base_url=OSRM_URL, timeout=OSRM_TIMEOUT, max_legs=100000):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_legs = max_legs
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        self._legs = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _point(p):
+        return (round(float(p[0]), 5), round(float(p[1]), 5))
+
+    def _remember(self, mode, start, end, leg):
+        with self._lock:
+            self._legs[(mode, start, end)] = leg
+            self._legs.move_to_end((mode, start, end))
+            while len(self._legs) > self.max_legs:
+                self._legs.popitem(last=False)
+
+    def _lookup(self, mode, start, end):
+        with self._lock:
+            leg = self._legs.get((mode, start, end))
+            if leg is not None:
+                self._legs.move_to_end((mode, start, end))
+            return leg
+
+    def route(self, start, end, mode='car'):
+        # start, end: (lat, lon)
+        start, end = self._point(start), self._point(end)
+        if start == end:
+            return {'mode': mode, 'duration_min': 0, 'distance_km': 0.0}
+        leg = self._lookup(mode, start, end)
+        metrics.cache_lookup('osrm_legs', leg is not None)
+        if leg is not None:
+            return dict(leg)
+        leg = self._fetch_route(start, end, mode)
+        if leg is None:
+            metrics.fallbacks_total.inc(kind='route_haversine')
+            return estimate_leg(start, end, mode)
+        self._remember(mode, start, end, leg)
+        return dict(leg)
+
+    def _fetch_route(self, start, end, mode):
+        try:
+            url = f"{self.base_url}/route/v1/{mode}/{start[1]},{start[0]};{end[1]},{end[0]}"
+            with metrics.upstream('osrm'):
+                resp = self.session.get(url, params={'overview': 'false'}, timeout=self.timeout)
+                data = resp.json()
+            if data.get('routes'):
+                duration = data['routes'][0]['duration'] / 60  # minutes
+                distance = data['routes'][0]['distance'] / 1000  # km
+                return {'mode': mode, 'duration_min': int(duration), 'distance_km': round(distance, 1)}
+        except Exception:
+            pass
+        return None
+
+    def prefetch(self, points, mode='car'):
+        # Fill the memo with every ordered pair of points using OSRM table calls.
+        # Cells the router can't fill are left out, so route() retries them on
+        # their own and falls back to haversine per leg.
+        points = list(dict.fromkeys(self._point(p) for p in points if p[0] is not None and p[1] is not None))
+        if len(points) < 2:
+            return
+        # Warm trips: every pair is already in the memo, so skip the request
+        with self._lock:
+            if all((mode, start, end) in self._legs for start in points for end in points if start != end):
+                return
+        size = OSRM_TABLE_MAX_COORDS
+        if len(points) <= size:
+            self._fetch_table(points, points, mode)
+            return
+        chunks = [points[i:i+size//2] for i in range(0, len(points), size//2)]
+        for sources in chunks:
+            for destinations in chunks:
+                self._fetch_table(sources, destinations, mode)
+
+    def _fetch_table(self, sources, destinations, mode):
+        if sources is destinations:
+            coords = sources
+            params = {}
+        else:
+            coords = sources + destinations
+            params = {
+                'sources': ';'.join(str(i) for i in range(len(sources))),
+                'destinations': ';'.join(str(i) for i in range(len(sources), len(coords))),
+            }
+        params['annotations'] = 'duration,distance'
+        try:
+            url = f"{self.base_url}/table/v1/{mode}/" + ';'.join(f"{lon},{lat}" for lat, lon in coords)
+            with metrics.upstream('osrm'):
+                resp = self.session.get(url, params=params, timeout=self.timeout)
+                data = resp.json()
+                durations = data['durations']
+                distances = data['distances']
+        except Exception:
+            metrics.fallbacks_total.inc(kind='osrm_table_failed')
+            return False
+        for i, start in enumerate(sources):
+            for j, end in enumerate(destinations):
+                if start == end or durations[i][j] is None or distances[i][j] is None:
+                    continue
+                self._remember(mode, start, end, {
+                    'mode': mode,
+                    'duration_min': int(durations[i][j] / 60),
+                    'distance_km': round(distances[i][j] / 1000, 1),
+                })
+        return True
+
+    def duration_matrix(self, points, mode='car'):
+        # Travel minutes between every pair of points: OSRM table values where
+        # the memo has them, the haversine estimate everywhere else
+        points = [self._point(p) for p in points]
+        lats, lons = zip(*points) if points else ((), ())
+        matrix = haversine_matrix(lats, lons) / FALLBACK_SPEED_KMH * 60
+        estimated = 0
+        with self._lock:
+            for i, start in enumerate(points):
+                for j, end in enumerate(points):
+                    leg = self._legs.get((mode, start, end))
+                    if leg is not None:
+                        matrix[i, j] = leg['duration_min']
+                    elif start != end:
+                        estimated += 1
+        if estimated:
+            metrics.fallbacks_total.inc(estimated, kind='matrix_haversine')
+        return matrix
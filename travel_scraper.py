@@ -1,103 +1,356 @@
 import requests
-from bs4 import BeautifulSoup
 import json
-import time
 import random
-from fake_useragent import UserAgent
 import re
 from datetime import datetime
 import os
+import threading
 from urllib.parse import quote_plus
-import wikipedia
-from math import radians, cos, sin, asin, sqrt
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from cache import DiskCache
+from rate_limiter import SharedTokenBucket
+from routing import Router, haversine
+from planner import plan_days
+from poi_index import default_index
+from places import PlaceTable, places_event
+import metrics
+
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+WIKIPEDIA_API_URL = os.getenv("WIKIPEDIA_API_URL", "https://en.wikipedia.org/w/api.php")
+WIKIPEDIA_WORKERS = int(os.getenv("WIKIPEDIA_WORKERS", 8))
+WIKIPEDIA_BATCH_SIZE = 20  # MediaWiki caps intro extracts at 20 pages per query
+# Places the local POI index returns must be within this distance of the destination
+POI_RADIUS_KM = float(os.getenv("POI_RADIUS_KM", 15))
+PLACES_CACHE_TTL = int(os.getenv("PLACES_CACHE_TTL", 24 * 3600))
+DEFAULT_PLACE_IMAGE = "https://upload.wikimedia.org/wikipedia/commons/3/3e/Generic_landmark.jpg"
+
+PLACE_CATEGORIES = {
+    'hotels': ["hotels", "accommodation", "hostel", "resort"],
+    'attractions': ["tourist attractions", "places to visit", "landmarks", "sightseeing"],
+    'restaurants': ["restaurants", "food", "cuisine", "dining"],
+}
 
 class TravelDataScraper:
-    def __init__(self):
-        self.ua = UserAgent()
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': self.ua.random,
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-        })
+    def __init__(self, geocode_cache=None, router=None, poi_index=None, places_cache=None):
+        # The user-agent pool and the HTTP session are built on first use, so
+        # importing the app and forking workers stays cheap
+        self._ua = None
+        self._session = None
+        self._wikipedia_pool = None
+        self._init_lock = threading.Lock()
+        self.router = router if router is not None else Router()
+        # Geocodes are shared across requests and worker processes; places
+        # Nominatim doesn't know are cached too (for a shorter time)
+        self.geocode_cache = geocode_cache if geocode_cache is not None else DiskCache('geocode')
+        # Places per destination, shared the same way. Concurrent trips to the
+        # same destination wait for one discovery instead of each running
+        # their own (see DiskCache.get_or_set).
+        self.places_cache = places_cache if places_cache is not None else DiskCache('places', ttl=PLACES_CACHE_TTL)
+        # Nominatim usage policy: at most 1 request per second, for the whole
+        # host, so the budget is shared by every worker process
+        self.nominatim_limiter = SharedTokenBucket('nominatim', rate=1, capacity=1)
+        # Local POI index (see poi_index.py); defaults to the one at POI_INDEX_DIR
+        self._poi_index = poi_index
+
+    @property
+    def ua(self):
+        with self._init_lock:
+            if self._ua is None:
+                from fake_useragent import UserAgent  # loads its browser database
+                self._ua = UserAgent()
+        return self._ua
+
+    @property
+    def session(self):
+        if self._session is None:
+            user_agent = self.ua.random
+            with self._init_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    session.headers.update({
+                        'User-Agent': user_agent,
+                        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+                        'Accept-Language': 'en-US,en;q=0.5',
+                        'Accept-Encoding': 'gzip, deflate',
+                        'Connection': 'keep-alive',
+                        'Upgrade-Insecure-Requests': '1',
+                    })
+                    self._session = session
+        return self._session
+
+    @property
+    def wikipedia_pool(self):
+        # One bounded pool for every discovery this scraper runs, so concurrent
+        # trips share WIKIPEDIA_WORKERS threads instead of starting their own
+        with self._init_lock:
+            if self._wikipedia_pool is None:
+                self._wikipedia_pool = ThreadPoolExecutor(max_workers=WIKIPEDIA_WORKERS, thread_name_prefix='wikipedia')
+        return self._wikipedia_pool
 
     def get_places_from_wikipedia(self, destination, category_keywords, max_results=8):
-        results = []
-        search_terms = [
-            f"{kw} in {destination}" for kw in category_keywords
-        ]
-        seen = set()
-        destination_lower = destination.lower()
-        for term in search_terms:
-            try:
-                pages = wikipedia.search(term, results=max_results*2)
-                for title in pages:
-                    if title in seen:
-                        continue
-                    seen.add(title)
+        return self.discover_places_from_wikipedia(destination, {'places': category_keywords}, max_results)['places']
+
+    @property
+    def poi_index(self):
+        return self._poi_index if self._poi_index is not None else default_index()
+
+    def discover_places(self, destination, categories, max_results=8, seed=None, near=None):
+        # Places for each category, from the local POI index when `near`
+        # (lat, lon) is known and the index has enough of them; only the
+        # categories it can't fill go to Wikipedia. The places are the same
+        # for every trip to a destination, so they are cached and shared;
+        # only the (seeded) ratings differ per trip.
+        key = json.dumps([destination.strip().lower(), categories, max_results], sort_keys=True)
+        cached = self.places_cache.get(key)
+        metrics.cache_lookup('places', cached is not DiskCache.MISS)
+        if cached is DiskCache.MISS:
+            # Nothing found at all usually means the upstreams failed; don't
+            # keep that for a day
+            cached = self.places_cache.get_or_set(
+                key, lambda: self._discover_places(destination, categories, max_results, near),
+                lease_ttl=120, cache_if=lambda found: any(found.values()),
+            )
+        return self._rate_places(cached, seed)
+
+    def _discover_places(self, destination, categories, max_results, near):
+        results = {name: [] for name in categories}
+        index = self.poi_index
+        if index is not None and near is not None and near[0] is not None and near[1] is not None:
+            for name in categories:
+                for poi in index.nearby(near[0], near[1], POI_RADIUS_KM, category=name, limit=max_results):
+                    results[name].append(self._place_from_poi(poi, destination))
+                metrics.cache_lookup('poi_index', len(results[name]) >= max_results)
+        missing = {name: keywords for name, keywords in categories.items() if len(results[name]) < max_results}
+        if not missing:
+            return results
+        taken = {p['name'] for places in results.values() for p in places}
+        found = self._discover_from_wikipedia(destination, missing, max_results)
+        for name, places in found.items():
+            extra = [p for p in places if p['name'] not in taken]
+            results[name].extend(extra[:max_results - len(results[name])])
+        return results
+
+    def _rate_places(self, places, seed=None):
+        # Copies of the places with a rating; places without one from their
+        # source get a seeded one
+        return {
+            name: [dict(p, rating=p['rating'] or self._seeded_rating(p['name'], seed)) for p in items]
+            for name, items in places.items()
+        }
+
+    def discover_places_from_wikipedia(self, destination, categories, max_results=8, seed=None):
+        return self._rate_places(self._discover_from_wikipedia(destination, categories, max_results), seed)
+
+    def _discover_from_wikipedia(self, destination, categories, max_results=8):
+        # categories: {name: [keywords]}. All searches run concurrently on the
+        # scraper's bounded pool. A title goes to the first category that found
+        # it, and a category stops as soon as it has max_results places.
+        results = {name: [] for name in categories}
+        pool = self.wikipedia_pool
+        submitted = []
+
+        def submit(fn, *args):
+            future = pool.submit(fn, *args)
+            submitted.append(future)
+            return future
+
+        try:
+            search_futures = {
+                name: [submit(self.search_wikipedia, f"{kw} in {destination}", max_results*2) for kw in keywords]
+                for name, keywords in categories.items()
+            }
+            candidates = {name: [] for name in categories}
+            seen = set()
+            for name, futures in search_futures.items():
+                for future in futures:
                     try:
-                        page = wikipedia.page(title, auto_suggest=False)
-                        summary = page.summary.lower()
-                        title_lower = title.lower()
-                        # Only include if destination is in title or summary
-                        if destination_lower not in title_lower and destination_lower not in summary:
-                            continue
-                        images = page.images
-                        image_url = next((img for img in images if img.lower().endswith(('.jpg', '.jpeg', '.png')) and 'logo' not in img.lower() and 'icon' not in img.lower()), None)
-                        rating = f"{random.uniform(4.0, 5.0):.1f}/5"
-                        results.append({
-                            'name': title,
-                            'image_url': image_url or "https://upload.wikimedia.org/wikipedia/commons/3/3e/Generic_landmark.jpg",
-                            'rating': rating,
-                            'location': destination,
-                        })
-                        if len(results) >= max_results:
-                            return results
+                        titles = future.result()
                     except Exception:
                         continue
-            except Exception:
-                continue
+                    for title in titles:
+                        if title not in seen:
+                            seen.add(title)
+                            candidates[name].append(title)
+            # Candidates are resolved in batches of titles per API call. Each
+            # category only asks for its next batch while it is still short of
+            # max_results, and categories run side by side.
+            batches = {
+                name: [titles[i:i+WIKIPEDIA_BATCH_SIZE] for i in range(0, len(titles), WIKIPEDIA_BATCH_SIZE)]
+                for name, titles in candidates.items()
+            }
+            futures = {}
+
+            def submit_next(name):
+                if batches[name]:
+                    batch = batches[name].pop(0)
+                    futures[submit(self.fetch_wikipedia_pages, batch)] = (name, batch)
+
+            for name in categories:
+                submit_next(name)
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, batch = futures.pop(future)
+                    try:
+                        pages = future.result()
+                    except Exception:
+                        pages = {}
+                    for title in batch:
+                        if len(results[name]) >= max_results:
+                            break
+                        place = self._place_from_wikipedia(title, pages.get(title), destination)
+                        if place is not None:
+                            results[name].append(place)
+                    if len(results[name]) < max_results:
+                        submit_next(name)
+        finally:
+            # The pool is shared: only drop this discovery's queued requests
+            for future in submitted:
+                future.cancel()
         return results
 
+    def search_wikipedia(self, term, limit=10):
+        # Article titles matching term, same query the wikipedia package sends
+        params = {
+            'action': 'query',
+            'format': 'json',
+            'formatversion': 2,
+            'list': 'search',
+            'srsearch': term,
+            'srlimit': limit,
+            'srprop': '',
+        }
+        with metrics.upstream('wikipedia'):
+            resp = self.session.get(WIKIPEDIA_API_URL, params=params, timeout=10)
+            resp.raise_for_status()
+        return [item['title'] for item in resp.json().get('query', {}).get('search', [])]
+
+    def _place_from_wikipedia(self, title, page, destination):
+        if page is None:
+            return None
+        destination_lower = destination.lower()
+        # Only include if destination is in title or summary
+        if destination_lower not in title.lower() and destination_lower not in page['summary'].lower():
+            return None
+        return {
+            'name': title,
+            'image_url': self._usable_image(page['image_url']) or DEFAULT_PLACE_IMAGE,
+            'rating': None,
+            'location': destination,
+            'lat': page['lat'],
+            'lon': page['lon'],
+        }
+
+    def _place_from_poi(self, poi, destination):
+        rating = f"{poi['rating']:.1f}/5" if poi['rating'] is not None else None
+        return {
+            'name': poi['name'],
+            'image_url': self._usable_image(poi['image_url']) or DEFAULT_PLACE_IMAGE,
+            'rating': rating,
+            'location': destination,
+            'lat': poi['lat'],
+            'lon': poi['lon'],
+        }
+
+    @staticmethod
+    def _usable_image(image_url):
+        if image_url and (not image_url.lower().endswith(('.jpg', '.jpeg', '.png')) or 'logo' in image_url.lower() or 'icon' in image_url.lower()):
+            return None
+        return image_url
+
+    @staticmethod
+    def _seeded_rating(title, seed=None):
+        # Seeded per title so a trip with the same seed always gets the same ratings
+        rng = random.Random(f"{seed}:{title}") if seed is not None else random
+        return f"{rng.uniform(4.0, 5.0):.1f}/5"
+
+    def fetch_wikipedia_pages(self, titles):
+        # Returns {title: {'summary', 'image_url', 'lat', 'lon'}} for every title
+        # that resolves to a real article. Each batch is a single MediaWiki
+        # query returning the intro extract, lead image and coordinates.
+        pages = {}
+        for i in range(0, len(titles), WIKIPEDIA_BATCH_SIZE):
+            pages.update(self._fetch_wikipedia_batch(titles[i:i+WIKIPEDIA_BATCH_SIZE]))
+        return pages
+
+    def _fetch_wikipedia_batch(self, titles):
+        params = {
+            'action': 'query',
+            'format': 'json',
+            'formatversion': 2,
+            'redirects': 1,
+            'prop': 'extracts|pageimages|coordinates|pageprops',
+            'exintro': 1,
+            'explaintext': 1,
+            'exlimit': 'max',
+            'piprop': 'thumbnail',
+            'pithumbsize': 800,
+            'pilimit': 'max',
+            'colimit': 'max',
+            'coprimary': 'primary',
+            'ppprop': 'disambiguation',
+            'titles': '|'.join(titles),
+        }
+        with metrics.upstream('wikipedia'):
+            resp = self.session.get(WIKIPEDIA_API_URL, params=params, timeout=10)
+            resp.raise_for_status()
+        query = resp.json().get('query', {})
+        aliases = {item['from']: item['to'] for item in query.get('normalized', []) + query.get('redirects', [])}
+        by_title = {}
+        for page in query.get('pages', []):
+            if page.get('missing') or page.get('invalid') or 'disambiguation' in page.get('pageprops', {}):
+                continue
+            coords = page.get('coordinates') or [{}]
+            by_title[page['title']] = {
+                'summary': page.get('extract', ''),
+                'image_url': page.get('thumbnail', {}).get('source'),
+                'lat': coords[0].get('lat'),
+                'lon': coords[0].get('lon'),
+            }
+        pages = {}
+        for title in titles:
+            # Follow normalization, then redirect
+            resolved = title
+            for _ in range(2):
+                resolved = aliases.get(resolved, resolved)
+            if resolved in by_title:
+                pages[title] = by_title[resolved]
+        return pages
+
     def get_coordinates(self, place_name, city):
-        try:
-            url = f"https://nominatim.openstreetmap.org/search?q={requests.utils.quote(place_name + ', ' + city)}&format=json&limit=1"
-            resp = self.session.get(url, headers={'User-Agent': self.ua.random})
-            time.sleep(0.5)
+        query = f"{place_name}, {city}"
+        key = query.strip().lower()
+        cached = self.geocode_cache.get(key)
+        metrics.cache_lookup('geocode', cached is not DiskCache.MISS)
+        if cached is DiskCache.MISS:
+            # Concurrent lookups of the same place (in any worker) share one
+            # Nominatim request
+            try:
+                cached = self.geocode_cache.get_or_set(key, lambda: self._geocode(query), lease_ttl=30)
+            except Exception:
+                # Network/server errors are not cached so the next request retries
+                return None, None
+        return tuple(cached) if cached else (None, None)
+
+    def _geocode(self, query):
+        # [lat, lon], or None when Nominatim doesn't know the place
+        with metrics.stage('nominatim_wait'):
+            self.nominatim_limiter.acquire()
+        with metrics.upstream('nominatim'):
+            resp = self.session.get(NOMINATIM_URL, params={'q': query, 'format': 'json', 'limit': 1}, headers={'User-Agent': self.ua.random}, timeout=10)
+            resp.raise_for_status()
             data = resp.json()
-            if data:
-                return float(data[0]['lat']), float(data[0]['lon'])
-        except Exception:
-            pass
-        return None, None
+        if data:
+            return [float(data[0]['lat']), float(data[0]['lon'])]
+        return None
 
     def osrm_route(self, start, end, mode='car'):
         # start, end: (lat, lon)
-        try:
-            url = f"http://router.project-osrm.org/route/v1/{mode}/{start[1]},{start[0]};{end[1]},{end[0]}?overview=false"
-            resp = requests.get(url)
-            data = resp.json()
-            if data['routes']:
-                duration = data['routes'][0]['duration'] / 60  # minutes
-                distance = data['routes'][0]['distance'] / 1000  # km
-                return {'mode': mode, 'duration_min': int(duration), 'distance_km': round(distance, 1)}
-        except Exception:
-            pass
-        # fallback: haversine
-        dist = self.haversine(start[0], start[1], end[0], end[1])
-        return {'mode': mode, 'duration_min': int(dist/50*60), 'distance_km': round(dist, 1)}  # assume 50km/h
+        # Served from the OSRM table memo when prefetched, falls back to haversine
+        return self.router.route(start, end, mode)
 
     def haversine(self, lat1, lon1, lat2, lon2):
-        # Calculate the great circle distance between two points
-        R = 6371  # Earth radius in km
-        dlat = radians(lat2 - lat1)
-        dlon = radians(lon2 - lon1)
-        a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-        c = 2 * asin(sqrt(a))
-        return R * c
+        return haversine(lat1, lon1, lat2, lon2)
 
     def find_nearest(self, base_places, candidate_places, n=2):
         # base_places: list of dicts with 'lat', 'lon'
@@ -107,18 +360,21 @@ class TravelDataScraper:
             return []
         mean_lat = sum(p['lat'] for p in base_places if p['lat'] is not None) / len(base_places)
         mean_lon = sum(p['lon'] for p in base_places if p['lon'] is not None) / len(base_places)
-        for c in candidate_places:
-            if c['lat'] is not None and c['lon'] is not None:
-                c['distance'] = self.haversine(mean_lat, mean_lon, c['lat'], c['lon'])
-            else:
-                c['distance'] = float('inf')
-        sorted_candidates = sorted(candidate_places, key=lambda x: x['distance'])
-        return sorted_candidates[:n]
+
+        def distance(c):
+            if c['lat'] is None or c['lon'] is None:
+                return float('inf')
+            return self.haversine(mean_lat, mean_lon, c['lat'], c['lon'])
+
+        return sorted(candidate_places, key=distance)[:n]
 
     def enrich_with_coords(self, places, city, coord_cache=None):
         if coord_cache is None:
             coord_cache = {}
         for p in places:
+            # Places found through the Wikipedia API usually carry coordinates already
+            if p.get('lat') is not None and p.get('lon') is not None:
+                continue
             key = (p['name'], city)
             if key in coord_cache:
                 lat, lon = coord_cache[key]
@@ -129,73 +385,91 @@ class TravelDataScraper:
             p['lon'] = lon
         return places
 
-    def scrape_all_data(self, starting_city, destination, days=1, budget=None):
+    def scrape_all_data(self, starting_city, destination, days=1, budget=None, seed=None, progress=None):
+        # progress: optional callback(stage, data), called with 'travel_info',
+        # 'places' and then 'day' once per day as each part becomes available
+        if progress is None:
+            progress = lambda stage, data: None
         # Step 1: Get coordinates for start and destination
-        start_latlon = self.get_coordinates(starting_city, starting_city)
-        dest_latlon = self.get_coordinates(destination, destination)
+        with metrics.stage('geocode'):
+            start_latlon = self.get_coordinates(starting_city, starting_city)
+            dest_latlon = self.get_coordinates(destination, destination)
         # Step 2: Get travel info from start to destination
-        travel_info = self.osrm_route(start_latlon, dest_latlon, mode='car')
+        with metrics.stage('travel_route'):
+            travel_info = self.osrm_route(start_latlon, dest_latlon, mode='car')
+        progress('travel_info', travel_info)
         # Step 3: Get places in destination
-        hotels = self.get_places_from_wikipedia(destination, ["hotels", "accommodation", "hostel", "resort"], max_results=8)
-        attractions = self.get_places_from_wikipedia(destination, ["tourist attractions", "places to visit", "landmarks", "sightseeing"], max_results=8)
-        restaurants = self.get_places_from_wikipedia(destination, ["restaurants", "food", "cuisine", "dining"], max_results=8)
+        with metrics.stage('places'):
+            places = self.discover_places(destination, PLACE_CATEGORIES, max_results=8, seed=seed, near=dest_latlon)
+        hotels = places['hotels']
+        attractions = places['attractions']
+        restaurants = places['restaurants']
         coord_cache = {}
-        hotels = self.enrich_with_coords(hotels, destination, coord_cache)
-        attractions = self.enrich_with_coords(attractions, destination, coord_cache)
-        restaurants = self.enrich_with_coords(restaurants, destination, coord_cache)
-        # Step 4: Build daily itinerary (simple greedy nearest-neighbor for demo)
-        itinerary = []
-        for day in range(1, days+1):
-            day_plan = {'day': day, 'steps': []}
-            # Pick a hotel for the night
-            hotel = random.choice([h for h in hotels if h['lat'] and h['lon']]) if hotels else None
-            # Start at hotel
-            if hotel:
-                day_plan['steps'].append({'type': 'hotel', 'place': hotel, 'note': 'Check-in/Start'})
-                prev = hotel
-            else:
-                prev = {'lat': dest_latlon[0], 'lon': dest_latlon[1]}
-            # Breakfast
-            breakfast = random.choice([r for r in restaurants if r['lat'] and r['lon']]) if restaurants else None
-            if breakfast:
-                route = self.osrm_route((prev['lat'], prev['lon']), (breakfast['lat'], breakfast['lon']))
-                day_plan['steps'].append({'type': 'breakfast', 'place': breakfast, 'route': route})
-                prev = breakfast
-            # Attractions (2-3 per day, nearest order)
-            day_attractions = random.sample([a for a in attractions if a['lat'] and a['lon']], min(3, len([a for a in attractions if a['lat'] and a['lon']]))) if attractions else []
-            for attr in day_attractions:
-                route = self.osrm_route((prev['lat'], prev['lon']), (attr['lat'], attr['lon']))
-                day_plan['steps'].append({'type': 'attraction', 'place': attr, 'route': route})
-                prev = attr
-            # Lunch
-            lunch = random.choice([r for r in restaurants if r['lat'] and r['lon'] and r != breakfast]) if restaurants else None
-            if lunch:
-                route = self.osrm_route((prev['lat'], prev['lon']), (lunch['lat'], lunch['lon']))
-                day_plan['steps'].append({'type': 'lunch', 'place': lunch, 'route': route})
-                prev = lunch
-            # More attractions (1-2)
-            more_attractions = random.sample([a for a in attractions if a['lat'] and a['lon'] and a not in day_attractions], min(2, len([a for a in attractions if a['lat'] and a['lon'] and a not in day_attractions]))) if attractions else []
-            for attr in more_attractions:
-                route = self.osrm_route((prev['lat'], prev['lon']), (attr['lat'], attr['lon']))
-                day_plan['steps'].append({'type': 'attraction', 'place': attr, 'route': route})
-                prev = attr
-            # Dinner
-            dinner = random.choice([r for r in restaurants if r['lat'] and r['lon'] and r != breakfast and r != lunch]) if restaurants else None
-            if dinner:
-                route = self.osrm_route((prev['lat'], prev['lon']), (dinner['lat'], dinner['lon']))
-                day_plan['steps'].append({'type': 'dinner', 'place': dinner, 'route': route})
-                prev = dinner
-            # Return to hotel
-            if hotel:
-                route = self.osrm_route((prev['lat'], prev['lon']), (hotel['lat'], hotel['lon']))
-                day_plan['steps'].append({'type': 'hotel', 'place': hotel, 'note': 'Return/Stay', 'route': route})
-            itinerary.append(day_plan)
+        with metrics.stage('enrich'):
+            hotels = self.enrich_with_coords(hotels, destination, coord_cache)
+            attractions = self.enrich_with_coords(attractions, destination, coord_cache)
+            restaurants = self.enrich_with_coords(restaurants, destination, coord_cache)
+        # Every located candidate goes into the trip's place table once; its
+        # id is also its row in the travel-time matrix below
+        table = PlaceTable()
+        ids = {}
+        for category, items in (('hotels', hotels), ('attractions', attractions), ('restaurants', restaurants)):
+            ids[category] = [table.add_dict(p, category) for p in items if p['lat'] and p['lon']]
+        progress('places', places_event(table))
+        # One OSRM table call covers every leg the day builder can pick
+        with metrics.stage('routing_table'):
+            self.router.prefetch([dest_latlon] + [(p.lat, p.lon) for p in table])
+        # Step 4: Build daily itinerary: every day is a cluster of nearby
+        # attractions, ordered to minimise travel time, with meals inserted
+        # where they add the least detour
+        with metrics.stage('plan'):
+            points = [(p.lat, p.lon) for p in table]
+            origin = None
+            if dest_latlon[0] is not None and dest_latlon[1] is not None:
+                origin = len(points)
+                points.append(dest_latlon)
+            cost = self.router.duration_matrix(points) if points else None
+            plan = plan_days(cost, days, ids['hotels'], ids['attractions'], ids['restaurants'], origin=origin)
+        with metrics.stage('build_days'):
+            itinerary = []
+            for day, day_indices in enumerate(plan, start=1):
+                day_plan = {'day': day, 'steps': []}
+                hotel = table[day_indices['hotel']] if day_indices['hotel'] is not None else None
+                # Start at hotel
+                if hotel:
+                    day_plan['steps'].append({'type': 'hotel', 'place_id': hotel.id, 'note': 'Check-in/Start'})
+                    prev = (hotel.lat, hotel.lon)
+                else:
+                    prev = dest_latlon
+                sequence = (
+                    [('breakfast', day_indices['breakfast'])]
+                    + [('attraction', i) for i in day_indices['morning']]
+                    + [('lunch', day_indices['lunch'])]
+                    + [('attraction', i) for i in day_indices['afternoon']]
+                    + [('dinner', day_indices['dinner'])]
+                )
+                for step_type, i in sequence:
+                    if i is None:
+                        continue
+                    place = table[i]
+                    route = self.osrm_route(prev, (place.lat, place.lon))
+                    day_plan['steps'].append({'type': step_type, 'place_id': place.id, 'route': route})
+                    prev = (place.lat, place.lon)
+                # Return to hotel
+                if hotel:
+                    route = self.osrm_route(prev, (hotel.lat, hotel.lon))
+                    day_plan['steps'].append({'type': 'hotel', 'place_id': hotel.id, 'note': 'Return/Stay', 'route': route})
+                itinerary.append(day_plan)
+                progress('day', day_plan)
         return {
             'starting_city': starting_city,
             'destination': destination,
             'travel_info': travel_info,
             'itinerary': itinerary,
+            'places': table,
+            'days': days,
             'budget': budget,
+            'seed': seed,
             'scraped_at': datetime.now().isoformat()
         }
 